@@ -3655,11 +3655,9 @@ def setup_autostart():
 
 def run_with_bridge():
     """Executa o app com o servidor WebSocket de bridge em background"""
-    import asyncio
-    
     # Tenta importar o servidor WebSocket
     try:
-        from websocket_server import BridgeWebSocketServer
+        from websocket_server import BridgeWebSocketServer, run_event_loop
         BRIDGE_AVAILABLE = True
     except ImportError:
         BRIDGE_AVAILABLE = False
@@ -3672,7 +3670,7 @@ def run_with_bridge():
         
         try:
             server = BridgeWebSocketServer()
-            asyncio.run(server.start())
+            run_event_loop(server.start())
         except Exception as e:
             logger.error(f"Erro no servidor WebSocket: {e}")
     
@@ -20,6 +20,7 @@ def install_requirements():
         ("pystray", "pystray"),
         ("PIL", "Pillow"),
         ("websockets", "websockets"),
+        ("winloop", "winloop") if platform.system() == 'Windows' else ("uvloop", "uvloop"),
     ]
     
     for module_name, pip_name in deps:
@@ -85,6 +86,7 @@ def build_executable():
         "--hidden-import=websockets",
         "--hidden-import=websockets.server",
         "--hidden-import=websockets.client",
+        "--hidden-import=winloop" if system == 'Windows' else "--hidden-import=uvloop",
         # Requests para ONVIF
         "--hidden-import=requests",
         # Módulos do projeto
@@ -408,6 +408,7 @@ class HLSRelayBridge:
             "-hls_list_size", "6",           # 6 segmentos = 3s buffer
             "-hls_flags", "delete_segments+independent_segments+split_by_time",
             "-hls_segment_type", "mpegts",
+            "-hls_start_number_source", "epoch",  # Nomes únicos entre reinícios (cache imutável)
             "-hls_segment_filename", str(stream_dir / "seg_%05d.ts"),
             str(output_playlist)
         ]
@@ -6,121 +6,217 @@ Suporta Basic e Digest Auth (incluindo qop=auth)
 
 import re
 import socket
+import asyncio
 import hashlib
 import random
 import base64
 import logging
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
 
-def test_rtsp_connection(rtsp_url: str, timeout: int = 5) -> tuple:
-    """
-    Testa conexão RTSP localmente com suporte a Basic e Digest Auth (incluindo qop=auth).
-    Retorna (sucesso: bool, mensagem: str, detalhes: dict)
-    """
-    debug_info = []  # Para coletar informações de debug
+def _md5_hash(text: str) -> str:
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def _generate_cnonce(length: int = 8) -> str:
+    """Gera um client nonce aleatório (8 chars hex)"""
+    return ''.join(random.choices('0123456789abcdef', k=length))
+
+
+def _parse_www_authenticate(header: str) -> dict:
+    """Parse WWW-Authenticate header para extrair realm, nonce, qop, etc"""
+    result = {}
+    # Extrai realm
+    realm_match = re.search(r'realm="([^"]*)"', header)
+    if realm_match:
+        result['realm'] = realm_match.group(1)
+    # Extrai nonce
+    nonce_match = re.search(r'nonce="([^"]*)"', header)
+    if nonce_match:
+        result['nonce'] = nonce_match.group(1)
+    # Extrai qop
+    qop_match = re.search(r'qop="([^"]*)"', header)
+    if qop_match:
+        result['qop'] = qop_match.group(1)
+    # Extrai opaque (se existir)
+    opaque_match = re.search(r'opaque="([^"]*)"', header)
+    if opaque_match:
+        result['opaque'] = opaque_match.group(1)
+    # Extrai algorithm (se existir)
+    algo_match = re.search(r'algorithm=([^,\s]+)', header)
+    if algo_match:
+        result['algorithm'] = algo_match.group(1).strip('"')
+    return result
+
+
+def _create_digest_auth(debug_info: list, username: str, password: str, realm: str, nonce: str,
+                        uri: str, method: str = "DESCRIBE", qop: str = None,
+                        opaque: str = None, nc_val: str = "00000001") -> str:
+    """Cria header de autenticação Digest (RFC 2617) com suporte a qop=auth"""
+    ha1 = _md5_hash(f"{username}:{realm}:{password}")
+    ha2 = _md5_hash(f"{method}:{uri}")
     
-    def md5_hash(text: str) -> str:
-        return hashlib.md5(text.encode()).hexdigest()
-    
-    def generate_cnonce(length: int = 8) -> str:
-        """Gera um client nonce aleatório (8 chars hex)"""
-        return ''.join(random.choices('0123456789abcdef', k=length))
-    
-    def parse_www_authenticate(header: str) -> dict:
-        """Parse WWW-Authenticate header para extrair realm, nonce, qop, etc"""
-        result = {}
-        # Extrai realm
-        realm_match = re.search(r'realm="([^"]*)"', header)
-        if realm_match:
-            result['realm'] = realm_match.group(1)
-        # Extrai nonce
-        nonce_match = re.search(r'nonce="([^"]*)"', header)
-        if nonce_match:
-            result['nonce'] = nonce_match.group(1)
-        # Extrai qop
-        qop_match = re.search(r'qop="([^"]*)"', header)
-        if qop_match:
-            result['qop'] = qop_match.group(1)
-        # Extrai opaque (se existir)
-        opaque_match = re.search(r'opaque="([^"]*)"', header)
-        if opaque_match:
-            result['opaque'] = opaque_match.group(1)
-        # Extrai algorithm (se existir)
-        algo_match = re.search(r'algorithm=([^,\s]+)', header)
-        if algo_match:
-            result['algorithm'] = algo_match.group(1).strip('"')
-        return result
-    
-    def create_digest_auth(username: str, password: str, realm: str, nonce: str, 
-                           uri: str, method: str = "DESCRIBE", qop: str = None, 
-                           opaque: str = None, nc_val: str = "00000001") -> str:
-        """Cria header de autenticação Digest (RFC 2617) com suporte a qop=auth"""
-        ha1 = md5_hash(f"{username}:{realm}:{password}")
-        ha2 = md5_hash(f"{method}:{uri}")
-        
-        debug_info.append(f"HA1 input: {username}:{realm}:{password}")
-        debug_info.append(f"HA1: {ha1}")
-        debug_info.append(f"HA2 input: {method}:{uri}")
-        debug_info.append(f"HA2: {ha2}")
-        
-        if qop and 'auth' in qop:
-            # Com qop=auth, precisa de nc e cnonce
-            nc = nc_val
-            cnonce = generate_cnonce()
-            response_input = f"{ha1}:{nonce}:{nc}:{cnonce}:auth:{ha2}"
-            response = md5_hash(response_input)
-            
-            debug_info.append(f"Response input (qop=auth): {response_input}")
-            debug_info.append(f"Response: {response}")
-            
-            auth_parts = [
-                f'username="{username}"',
-                f'realm="{realm}"',
-                f'nonce="{nonce}"',
-                f'uri="{uri}"',
-                f'qop=auth',
-                f'nc={nc}',
-                f'cnonce="{cnonce}"',
-                f'response="{response}"',
-            ]
-            if opaque:
-                auth_parts.append(f'opaque="{opaque}"')
-            
-            return 'Digest ' + ', '.join(auth_parts)
-        else:
-            # Sem qop (RFC 2069 estilo antigo)
-            response_input = f"{ha1}:{nonce}:{ha2}"
-            response = md5_hash(response_input)
-            
-            debug_info.append(f"Response input (no qop): {response_input}")
-            debug_info.append(f"Response: {response}")
-            
-            auth_parts = [
-                f'username="{username}"',
-                f'realm="{realm}"',
-                f'nonce="{nonce}"',
-                f'uri="{uri}"',
-                f'response="{response}"',
-            ]
-            if opaque:
-                auth_parts.append(f'opaque="{opaque}"')
-            
-            return 'Digest ' + ', '.join(auth_parts)
+    debug_info.append(f"HA1 input: {username}:{realm}:{password}")
+    debug_info.append(f"HA1: {ha1}")
+    debug_info.append(f"HA2 input: {method}:{uri}")
+    debug_info.append(f"HA2: {ha2}")
     
-    # Parse URL
+    if qop and 'auth' in qop:
+        # Com qop=auth, precisa de nc e cnonce
+        nc = nc_val
+        cnonce = _generate_cnonce()
+        response_input = f"{ha1}:{nonce}:{nc}:{cnonce}:auth:{ha2}"
+        response = _md5_hash(response_input)
+        
+        debug_info.append(f"Response input (qop=auth): {response_input}")
+        debug_info.append(f"Response: {response}")
+        
+        auth_parts = [
+            f'username="{username}"',
+            f'realm="{realm}"',
+            f'nonce="{nonce}"',
+            f'uri="{uri}"',
+            f'qop=auth',
+            f'nc={nc}',
+            f'cnonce="{cnonce}"',
+            f'response="{response}"',
+        ]
+        if opaque:
+            auth_parts.append(f'opaque="{opaque}"')
+        
+        return 'Digest ' + ', '.join(auth_parts)
+    else:
+        # Sem qop (RFC 2069 estilo antigo)
+        response_input = f"{ha1}:{nonce}:{ha2}"
+        response = _md5_hash(response_input)
+        
+        debug_info.append(f"Response input (no qop): {response_input}")
+        debug_info.append(f"Response: {response}")
+        
+        auth_parts = [
+            f'username="{username}"',
+            f'realm="{realm}"',
+            f'nonce="{nonce}"',
+            f'uri="{uri}"',
+            f'response="{response}"',
+        ]
+        if opaque:
+            auth_parts.append(f'opaque="{opaque}"')
+        
+        return 'Digest ' + ', '.join(auth_parts)
+
+
+def _parse_rtsp_url(rtsp_url: str) -> Optional[tuple]:
+    """Retorna (user, password, host, port, path) ou None se a URL for inválida"""
     pattern = r'rtsp://(?:([^:@]+):([^@]+)@)?([^:/]+):?(\d+)?(/.*)?'
     match = re.match(pattern, rtsp_url)
     
     if not match:
-        return False, "URL RTSP inválida", {}
+        return None
     
     user = match.group(1) or ''
     password = match.group(2) or ''
     host = match.group(3)
     port = int(match.group(4)) if match.group(4) else 554
     path = match.group(5) or '/'
+    return user, password, host, port, path
+
+
+def _describe_request(full_uri: str, cseq: int, auth_header: str = None) -> bytes:
+    """Monta request DESCRIBE (com ou sem Authorization)"""
+    auth_line = f"Authorization: {auth_header}\r\n" if auth_header else ""
+    return (
+        f"DESCRIBE {full_uri} RTSP/1.0\r\nCSeq: {cseq}\r\nUser-Agent: CameraScanner/1.0\r\n"
+        f"{auth_line}Accept: application/sdp\r\n\r\n"
+    ).encode()
+
+
+def _build_auth_header(response: str, user: str, password: str,
+                       digest_uri: str, debug_info: list) -> tuple:
+    """Escolhe Basic/Digest a partir do 401. Retorna (auth_type, auth_params, auth_header)"""
+    auth_type = "Basic"
+    auth_params = {}
+    
+    debug_info.append(f"=== WWW-Authenticate Header ===")
+    debug_info.append(response[:500])
+    
+    if 'Digest' in response:
+        auth_type = "Digest"
+        auth_params = _parse_www_authenticate(response)
+        debug_info.append(f"Auth params: {auth_params}")
+    
+    if auth_type == "Digest" and auth_params.get('realm') and auth_params.get('nonce'):
+        # Usa Digest Auth com suporte a qop
+        auth_header = _create_digest_auth(
+            debug_info,
+            user, password,
+            auth_params['realm'],
+            auth_params['nonce'],
+            digest_uri,
+            qop=auth_params.get('qop'),
+            opaque=auth_params.get('opaque')
+        )
+    else:
+        # Usa Basic Auth
+        auth_string = base64.b64encode(f"{user}:{password}".encode()).decode()
+        auth_header = f"Basic {auth_string}"
+    
+    debug_info.append(f"=== Auth Header Enviado ===")
+    debug_info.append(auth_header)
+    
+    return auth_type, auth_params, auth_header
+
+
+def _auth_result(response2: str, auth_type: str, auth_params: dict, debug_info: list) -> tuple:
+    """Interpreta a resposta do DESCRIBE autenticado"""
+    debug_info.append(f"=== Resposta da câmera ===")
+    debug_info.append(response2[:300])
+    
+    # Log de debug no console
+    print("\n".join(debug_info))
+    
+    if 'RTSP/1.0 200' in response2:
+        return True, f"Autenticação {auth_type} OK!", {"response": "200 OK", "requires_auth": True, "auth_type": auth_type, "debug": debug_info}
+    elif 'RTSP/1.0 401' in response2:
+        # Mostra debug na mensagem de erro
+        debug_summary = f"\nRealm: {auth_params.get('realm')}, Nonce: {auth_params.get('nonce', '')[:20]}..."
+        return False, f"Credenciais incorretas ({auth_type}){debug_summary}", {"response": "401 Unauthorized", "auth_type": auth_type, "debug": debug_info}
+    else:
+        status_match = re.search(r'RTSP/1\.0 (\d+)', response2)
+        status = status_match.group(1) if status_match else 'Desconhecido'
+        return False, f"Erro: {status}", {"response": status, "debug": debug_info}
+
+
+def _initial_result(response: str) -> tuple:
+    """Interpreta a resposta do primeiro DESCRIBE (exceto 401 com credenciais)"""
+    if 'RTSP/1.0 200' in response:
+        return True, "Conexão RTSP bem-sucedida!", {"response": "200 OK", "requires_auth": False}
+    elif 'RTSP/1.0 401' in response:
+        return False, "Requer autenticação", {"response": "401 Unauthorized", "requires_auth": True}
+    elif 'RTSP/1.0 404' in response:
+        return False, "Stream não encontrado", {"response": "404 Not Found"}
+    elif 'RTSP/1.0 403' in response:
+        return False, "Acesso negado", {"response": "403 Forbidden"}
+    else:
+        status_match = re.search(r'RTSP/1\.0 (\d+)', response)
+        status = status_match.group(1) if status_match else 'Desconhecido'
+        return False, f"Resposta: {status}", {"response": status}
+
+
+def test_rtsp_connection(rtsp_url: str, timeout: int = 5) -> tuple:
+    """
+    Testa conexão RTSP localmente com suporte a Basic e Digest Auth (incluindo qop=auth).
+    Retorna (sucesso: bool, mensagem: str, detalhes: dict)
+    """
+    debug_info = []  # Para coletar informações de debug
+    
+    parsed = _parse_rtsp_url(rtsp_url)
+    if not parsed:
+        return False, "URL RTSP inválida", {}
+    
+    user, password, host, port, path = parsed
     
     try:
         # Conecta via socket TCP
@@ -128,100 +224,32 @@ def test_rtsp_connection(rtsp_url: str, timeout: int = 5) -> tuple:
         sock.settimeout(timeout)
         sock.connect((host, port))
         
-        # Envia DESCRIBE request inicial (sem auth)
-        cseq = 1
         # URI completa para o request RTSP
         full_uri = f"rtsp://{host}:{port}{path}"
         # URI para Digest Auth (apenas o path)
         digest_uri = path
         
-        describe_req = f"DESCRIBE {full_uri} RTSP/1.0\r\nCSeq: {cseq}\r\nUser-Agent: CameraScanner/1.0\r\nAccept: application/sdp\r\n\r\n"
-        sock.send(describe_req.encode())
+        # Envia DESCRIBE request inicial (sem auth)
+        sock.send(_describe_request(full_uri, 1))
         
         response = sock.recv(4096).decode('utf-8', errors='ignore')
         
-        # Analisa resposta
-        if 'RTSP/1.0 200' in response:
-            sock.close()
-            return True, "Conexão RTSP bem-sucedida!", {"response": "200 OK", "requires_auth": False}
-        
-        elif 'RTSP/1.0 401' in response:
-            # Requer autenticação - tenta com credenciais se fornecidas
-            if user and password:
-                # Verifica tipo de autenticação
-                auth_type = "Basic"
-                auth_params = {}
-                
-                debug_info.append(f"=== WWW-Authenticate Header ===")
-                debug_info.append(response[:500])
-                
-                if 'Digest' in response:
-                    auth_type = "Digest"
-                    auth_params = parse_www_authenticate(response)
-                    debug_info.append(f"Auth params: {auth_params}")
-                
-                # IMPORTANTE: Reutiliza a MESMA conexão socket!
-                # Muitas câmeras geram um novo nonce por conexão
-                cseq = 2
-                
-                if auth_type == "Digest" and auth_params.get('realm') and auth_params.get('nonce'):
-                    # Usa Digest Auth com suporte a qop
-                    auth_header = create_digest_auth(
-                        user, password, 
-                        auth_params['realm'], 
-                        auth_params['nonce'],
-                        digest_uri,
-                        qop=auth_params.get('qop'),
-                        opaque=auth_params.get('opaque')
-                    )
-                else:
-                    # Usa Basic Auth
-                    auth_string = base64.b64encode(f"{user}:{password}".encode()).decode()
-                    auth_header = f"Basic {auth_string}"
-                
-                debug_info.append(f"=== Auth Header Enviado ===")
-                debug_info.append(auth_header)
-                
-                # Envia na MESMA conexão
-                auth_req = f"DESCRIBE {full_uri} RTSP/1.0\r\nCSeq: {cseq}\r\nUser-Agent: CameraScanner/1.0\r\nAuthorization: {auth_header}\r\nAccept: application/sdp\r\n\r\n"
-                sock.send(auth_req.encode())
-                
-                response2 = sock.recv(4096).decode('utf-8', errors='ignore')
-                sock.close()
-                
-                debug_info.append(f"=== Resposta da câmera ===")
-                debug_info.append(response2[:300])
-                
-                # Log de debug no console
-                print("\n".join(debug_info))
-                
-                if 'RTSP/1.0 200' in response2:
-                    return True, f"Autenticação {auth_type} OK!", {"response": "200 OK", "requires_auth": True, "auth_type": auth_type, "debug": debug_info}
-                elif 'RTSP/1.0 401' in response2:
-                    # Mostra debug na mensagem de erro
-                    debug_summary = f"\nRealm: {auth_params.get('realm')}, Nonce: {auth_params.get('nonce', '')[:20]}..."
-                    return False, f"Credenciais incorretas ({auth_type}){debug_summary}", {"response": "401 Unauthorized", "auth_type": auth_type, "debug": debug_info}
-                else:
-                    status_match = re.search(r'RTSP/1\.0 (\d+)', response2)
-                    status = status_match.group(1) if status_match else 'Desconhecido'
-                    return False, f"Erro: {status}", {"response": status, "debug": debug_info}
-            else:
-                sock.close()
-                return False, "Requer autenticação", {"response": "401 Unauthorized", "requires_auth": True}
-        
-        elif 'RTSP/1.0 404' in response:
-            sock.close()
-            return False, "Stream não encontrado", {"response": "404 Not Found"}
-        
-        elif 'RTSP/1.0 403' in response:
+        if 'RTSP/1.0 401' in response and user and password:
+            auth_type, auth_params, auth_header = _build_auth_header(
+                response, user, password, digest_uri, debug_info
+            )
+            
+            # IMPORTANTE: Reutiliza a MESMA conexão socket!
+            # Muitas câmeras geram um novo nonce por conexão
+            sock.send(_describe_request(full_uri, 2, auth_header))
+            
+            response2 = sock.recv(4096).decode('utf-8', errors='ignore')
             sock.close()
-            return False, "Acesso negado", {"response": "403 Forbidden"}
+            
+            return _auth_result(response2, auth_type, auth_params, debug_info)
         
-        else:
-            sock.close()
-            status_match = re.search(r'RTSP/1\.0 (\d+)', response)
-            status = status_match.group(1) if status_match else 'Desconhecido'
-            return False, f"Resposta: {status}", {"response": status}
+        sock.close()
+        return _initial_result(response)
         
     except socket.timeout:
         return False, "Timeout na conexão", {"error": "timeout"}
@@ -229,3 +257,59 @@ def test_rtsp_connection(rtsp_url: str, timeout: int = 5) -> tuple:
         return False, "Conexão recusada", {"error": "connection_refused"}
     except Exception as e:
         return False, f"Erro: {str(e)}", {"error": str(e)}
+
+
+async def test_rtsp_connection_async(rtsp_url: str, timeout: int = 5) -> tuple:
+    """
+    Versão assíncrona de test_rtsp_connection (sem thread de executor).
+    Usa asyncio.open_connection para o handshake DESCRIBE.
+    Retorna (sucesso: bool, mensagem: str, detalhes: dict)
+    """
+    debug_info = []  # Para coletar informações de debug
+    
+    parsed = _parse_rtsp_url(rtsp_url)
+    if not parsed:
+        return False, "URL RTSP inválida", {}
+    
+    user, password, host, port, path = parsed
+    writer = None
+    
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout=timeout
+        )
+        
+        full_uri = f"rtsp://{host}:{port}{path}"
+        digest_uri = path
+        
+        writer.write(_describe_request(full_uri, 1))
+        await writer.drain()
+        
+        data = await asyncio.wait_for(reader.read(4096), timeout=timeout)
+        response = data.decode('utf-8', errors='ignore')
+        
+        if 'RTSP/1.0 401' in response and user and password:
+            auth_type, auth_params, auth_header = _build_auth_header(
+                response, user, password, digest_uri, debug_info
+            )
+            
+            # Mesma conexão - muitas câmeras geram um novo nonce por conexão
+            writer.write(_describe_request(full_uri, 2, auth_header))
+            await writer.drain()
+            
+            data = await asyncio.wait_for(reader.read(4096), timeout=timeout)
+            response2 = data.decode('utf-8', errors='ignore')
+            
+            return _auth_result(response2, auth_type, auth_params, debug_info)
+        
+        return _initial_result(response)
+        
+    except asyncio.TimeoutError:
+        return False, "Timeout na conexão", {"error": "timeout"}
+    except ConnectionRefusedError:
+        return False, "Conexão recusada", {"error": "connection_refused"}
+    except Exception as e:
+        return False, f"Erro: {str(e)}", {"error": str(e)}
+    finally:
+        if writer is not None:
+            writer.close()
@@ -16,8 +16,10 @@ import socket
 import platform
 import uuid
 import os
-from typing import Set, Optional
-from datetime import datetime
+import weakref
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from http import HTTPStatus
 
 try:
@@ -25,11 +27,24 @@ try:
     WEBSOCKETS_AVAILABLE = True
     # Check websockets version for API compatibility
     WEBSOCKETS_VERSION = tuple(int(x) for x in websockets.__version__.split('.')[:2])
+    _ws_broadcast = getattr(websockets, "broadcast", None)  # websockets >= 10
 except ImportError:
     WEBSOCKETS_AVAILABLE = False
     WEBSOCKETS_VERSION = (0, 0)
+    _ws_broadcast = None
     print("⚠ websockets não instalado. Execute: pip install websockets")
 
+# Event loop mais rápido (opcional): uvloop no Linux/macOS, winloop no Windows
+try:
+    if platform.system() == "Windows":
+        import winloop as uvloop
+    else:
+        import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    uvloop = None
+    UVLOOP_AVAILABLE = False
+
 # Tentar importar HLS Relay primeiro (preferencial)
 try:
     from hls_relay_bridge import HLSRelayBridge
@@ -42,6 +57,30 @@ from stream_bridge import StreamBridge
 
 logger = logging.getLogger(__name__)
 
+# Tamanho máximo da fila de saída por cliente - clientes lentos são desconectados
+CLIENT_QUEUE_SIZE = 256
+
+# Envio direto (websockets.broadcast) só com o buffer de escrita do cliente abaixo disso (bytes);
+# acima, a mensagem vai para a fila - backpressure via send() e desconexão com a fila cheia
+DIRECT_SEND_BUFFER_LIMIT = 64 * 1024
+
+# Clientes por lote no broadcast - cede o event loop entre lotes
+BROADCAST_BATCH_SIZE = 50
+
+# Validade do IP local em cache (segundos)
+LOCAL_IP_TTL = 30
+
+# Janela de agregação do progresso de instalação do FFmpeg (segundos)
+PROGRESS_COALESCE_INTERVAL = 0.1
+
+# Máximo de testes RTSP simultâneos
+MAX_CONCURRENT_RTSP_TESTS = 16
+
+
+def _iso_now() -> str:
+    """Hora local em ISO 8601 (resolução de segundos)"""
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
+
 
 def process_request_legacy(path, request_headers):
     """
@@ -134,18 +173,51 @@ class BridgeWebSocketServer:
             "https://ivms-streaming.up.railway.app"
         )
         
-        self.clients: Set = set()
+        # Clientes conectados. A fila de saída e a task de escrita ficam no
+        # próprio websocket (_out_queue/_out_writer); o WeakSet não retém
+        # conexões já encerradas
+        self.clients = weakref.WeakSet()
         self.bridge = None  # StreamBridge ou HLSRelayBridge
         self.bridge_mode = "unknown"  # "hls-relay" ou "rtmp-bridge"
         self.server = None
         self._running = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Pool próprio para as chamadas bloqueantes do bridge (start/stop de FFmpeg)
+        self._bridge_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bridge")
+        self._rtsp_test_slots = asyncio.Semaphore(MAX_CONCURRENT_RTSP_TESTS)
+        self._pending_progress: Optional[dict] = None
+        self._progress_handle: Optional[asyncio.TimerHandle] = None
         self._ffmpeg_installing = False
         self.client_id = str(uuid.uuid4())[:8]
         self.hostname = platform.node()
         self.os_info = f"{platform.system()} {platform.release()}"
+        self._local_ip: Optional[str] = None
+        self._local_ip_checked = 0.0
+        self._bridge_info_prefix = ""
+        
+        # Tabela de despacho: tipo da mensagem -> handler
+        self._handlers = {
+            "get_bridge_info": self._handle_get_bridge_info,
+            "start_stream": self._handle_start_stream,
+            "stop_stream": self._handle_stop_stream,
+            "list_streams": self._handle_list_streams,
+            "test_rtsp": self._handle_test_rtsp,
+            "start_scan": self._handle_start_scan,
+            "stop_scan": self._handle_stop_scan,
+        }
+        # Timestamp ISO atualizado 1x por segundo pelo loop principal
+        self._now_iso = _iso_now()
         
     def get_local_ip(self) -> str:
-        """Obtém IP local da máquina"""
+        """Obtém IP local da máquina (em cache por LOCAL_IP_TTL segundos)"""
+        now = time.monotonic()
+        if self._local_ip is None or now - self._local_ip_checked > LOCAL_IP_TTL:
+            self._local_ip = self._detect_local_ip()
+            self._local_ip_checked = now
+        return self._local_ip
+    
+    def _detect_local_ip(self) -> str:
+        """Descobre o IP local abrindo um socket UDP (sem enviar pacotes)"""
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             s.connect(("8.8.8.8", 80))
@@ -155,24 +227,42 @@ class BridgeWebSocketServer:
         except:
             return "127.0.0.1"
     
+    def _bridge_info_json(self) -> str:
+        """Mensagem bridge_connected já serializada: prefixo estático + campos dinâmicos"""
+        ffmpeg_available = self.bridge.is_ffmpeg_available() if self.bridge else False
+        active_streams = len(self.bridge.active_streams) if self.bridge else 0
+        return (
+            f'{self._bridge_info_prefix}, "local_ip": "{self.get_local_ip()}", '
+            f'"ffmpeg_available": {"true" if ffmpeg_available else "false"}, '
+            f'"ffmpeg_installing": {"true" if self._ffmpeg_installing else "false"}, '
+            f'"active_streams": {active_streams}, "timestamp": "{self._now_iso}"}}}}'
+        )
+    
+    def _call_in_loop(self, callback, *args):
+        """Agenda callback no event loop do servidor (callbacks vêm de threads do bridge)"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(callback, *args)
+    
     def on_stream_status_change(self, stream_key: str, status: str, error: str):
         """Callback quando o status de um stream muda"""
-        asyncio.create_task(self.broadcast({
+        self._call_in_loop(self._broadcast_nowait, {
             "type": "stream_status",
             "data": {
                 "stream_key": stream_key,
                 "status": status,
                 "error": error
             }
-        }))
+        })
     
-    def _test_rtsp_connection(self, rtsp_url: str) -> dict:
+    async def _test_rtsp_connection(self, rtsp_url: str) -> dict:
         """Testa conexão RTSP localmente com suporte a Digest Auth"""
         # Usa o módulo separado para evitar importação circular
-        from rtsp_tester import test_rtsp_connection
+        from rtsp_tester import test_rtsp_connection_async
         
         try:
-            success, message, details = test_rtsp_connection(rtsp_url, timeout=10)
+            async with self._rtsp_test_slots:
+                success, message, details = await test_rtsp_connection_async(rtsp_url, timeout=10)
             
             if success:
                 return {
@@ -201,56 +291,140 @@ class BridgeWebSocketServer:
     
     def on_ffmpeg_progress(self, message: str, percent: int):
         """Callback para progresso da instalação do FFmpeg"""
-        asyncio.create_task(self.broadcast({
+        self._call_in_loop(self._queue_progress, {
             "type": "ffmpeg_install_progress",
             "data": {
                 "message": message,
                 "percent": percent,
                 "installing": self._ffmpeg_installing
             }
-        }))
+        })
+    
+    def _queue_progress(self, message: dict):
+        """Guarda só o progresso mais recente e agenda um envio por janela"""
+        self._pending_progress = message
+        if self._progress_handle is None:
+            self._progress_handle = self._loop.call_later(
+                PROGRESS_COALESCE_INTERVAL, self._flush_progress
+            )
+    
+    def _flush_progress(self):
+        """Envia o último progresso pendente"""
+        self._progress_handle = None
+        message, self._pending_progress = self._pending_progress, None
+        if message:
+            self._broadcast_nowait(message)
     
     async def broadcast(self, message: dict):
-        """Envia mensagem para todos os clientes conectados"""
+        """Enfileira mensagem para todos os clientes conectados"""
         if not self.clients:
             return
         
         message_str = json.dumps(message)
-        disconnected = set()
+        clients = list(self.clients)
+        
+        for i in range(0, len(clients), BROADCAST_BATCH_SIZE):
+            if i:
+                # Muitos clientes: ceder o loop para não atrasar leituras
+                await asyncio.sleep(0)
+            
+            self._enqueue(message_str, clients[i:i + BROADCAST_BATCH_SIZE])
+    
+    def _broadcast_nowait(self, message: dict):
+        """Broadcast síncrono (sem coroutine) - usado pelos callbacks do bridge"""
+        if self.clients:
+            self._enqueue(json.dumps(message), list(self.clients))
+    
+    def _enqueue(self, message_str: str, clients: list):
+        """Entrega mensagem já serializada aos clientes.
         
-        for client in self.clients:
+        Clientes ociosos (fila vazia, writer parado, buffer do transport abaixo de
+        DIRECT_SEND_BUFFER_LIMIT) recebem o frame direto via websockets.broadcast(),
+        sem acordar a task de escrita. Os demais passam pela própria fila: ordem
+        preservada e cliente lento desconectado quando a fila enche.
+        """
+        direct = []
+        for client in clients:
+            queue = client._out_queue
+            if _ws_broadcast is not None and queue.empty() and self._is_idle(client):
+                direct.append(client)
+                continue
             try:
-                await client.send(message_str)
-            except Exception as e:
-                logger.warning(f"Erro ao enviar para cliente: {e}")
-                disconnected.add(client)
+                queue.put_nowait(message_str)
+            except asyncio.QueueFull:
+                logger.warning("Cliente lento (fila cheia), desconectando")
+                self._drop_client(client)
         
-        self.clients -= disconnected
+        if direct:
+            _ws_broadcast(direct, message_str)
+    
+    @staticmethod
+    def _is_idle(websocket) -> bool:
+        """Writer parado e transport sem backlog - seguro escrever direto sem furar a ordem"""
+        if websocket._out_sending:
+            return False
+        transport = getattr(websocket, "transport", None)
+        if transport is None:
+            return False
+        try:
+            return transport.get_write_buffer_size() < DIRECT_SEND_BUFFER_LIMIT
+        except Exception:
+            return False
+    
+    async def _client_writer(self, websocket, queue: asyncio.Queue):
+        """Drena a fila de um cliente - um cliente lento não bloqueia os demais"""
+        try:
+            while True:
+                message = await queue.get()
+                # Mensagem fora da fila mas ainda não escrita: sem envio direto até terminar
+                websocket._out_sending = True
+                await websocket.send(message)
+                
+                # Rajada (ex.: progresso + status): escrever o que já está na
+                # fila em sequência, sem voltar a esperar em queue.get()
+                while not queue.empty():
+                    await websocket.send(queue.get_nowait())
+                websocket._out_sending = False
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Erro ao enviar para cliente: {e}")
+            self._drop_client(websocket)
+    
+    def _drop_client(self, websocket):
+        """Remove cliente e encerra sua task de escrita"""
+        if websocket not in self.clients:
+            return
+        self.clients.discard(websocket)
+        writer = websocket._out_writer
+        if writer is not asyncio.current_task():
+            writer.cancel()
+            # Fechar conexão para encerrar o loop de leitura em handle_client
+            asyncio.ensure_future(websocket.close())
+    
+    def _set_tcp_nodelay(self, websocket):
+        """Garante TCP_NODELAY no socket do cliente (mensagens pequenas e interativas)"""
+        try:
+            sock = websocket.transport.get_extra_info("socket")
+            if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except Exception as e:
+            logger.debug(f"TCP_NODELAY não aplicado: {e}")
     
     async def handle_client(self, websocket):
         """Handler para cada cliente WebSocket conectado"""
+        self._set_tcp_nodelay(websocket)
+        websocket._out_queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        websocket._out_sending = False
+        websocket._out_writer = asyncio.create_task(
+            self._client_writer(websocket, websocket._out_queue)
+        )
         self.clients.add(websocket)
         logger.info(f"Cliente conectado. Total: {len(self.clients)}")
         
         try:
             # Envia informações do bridge ao conectar
-            ffmpeg_available = self.bridge.is_ffmpeg_available() if self.bridge else False
-            
-            await websocket.send(json.dumps({
-                "type": "bridge_connected",
-                "data": {
-                    "client_id": self.client_id,
-                    "hostname": self.hostname,
-                    "os_info": self.os_info,
-                    "local_ip": self.get_local_ip(),
-                    "ffmpeg_available": ffmpeg_available,
-                    "ffmpeg_installing": self._ffmpeg_installing,
-                    "active_streams": len(self.bridge.active_streams) if self.bridge else 0,
-                    "bridge_mode": self.bridge_mode,  # "hls-relay" ou "rtmp-bridge"
-                    "relay_server_url": self.relay_server_url if self.bridge_mode == "hls-relay" else None,
-                    "timestamp": datetime.now().isoformat()
-                }
-            }))
+            await websocket.send(self._bridge_info_json())
             
             async for message in websocket:
                 await self.process_message(websocket, message)
@@ -259,6 +433,7 @@ class BridgeWebSocketServer:
             logger.error(f"Erro no cliente: {e}")
         finally:
             self.clients.discard(websocket)
+            websocket._out_writer.cancel()
             logger.info(f"Cliente desconectado. Total: {len(self.clients)}")
     
     async def process_message(self, websocket, message: str):
@@ -268,156 +443,9 @@ class BridgeWebSocketServer:
             msg_type = data.get("type", "")
             msg_data = data.get("data", {})
             
-            if msg_type == "get_bridge_info":
-                await websocket.send(json.dumps({
-                    "type": "bridge_connected",
-                    "data": {
-                        "client_id": self.client_id,
-                        "hostname": self.hostname,
-                        "os_info": self.os_info,
-                        "local_ip": self.get_local_ip(),
-                        "ffmpeg_available": self.bridge.is_ffmpeg_available() if self.bridge else False,
-                        "active_streams": len(self.bridge.active_streams) if self.bridge else 0,
-                        "bridge_mode": self.bridge_mode,
-                        "relay_server_url": self.relay_server_url if self.bridge_mode == "hls-relay" else None,
-                        "timestamp": datetime.now().isoformat()
-                    }
-                }))
-            
-            elif msg_type == "start_stream":
-                if not self.bridge:
-                    await websocket.send(json.dumps({
-                        "type": "stream_started",
-                        "data": {
-                            "success": False,
-                            "error": "Bridge não inicializado",
-                            "stream_key": msg_data.get("stream_key", "")
-                        }
-                    }))
-                    return
-                
-                stream_key = msg_data.get("stream_key", "")
-                rtsp_url = msg_data.get("rtsp_url", "")
-                camera_name = msg_data.get("camera_name", "")
-                
-                if not stream_key or not rtsp_url:
-                    await websocket.send(json.dumps({
-                        "type": "stream_started",
-                        "data": {
-                            "success": False,
-                            "error": "stream_key e rtsp_url são obrigatórios",
-                            "stream_key": stream_key
-                        }
-                    }))
-                    return
-                
-                # Inicia stream em thread separada para não bloquear
-                loop = asyncio.get_event_loop()
-                result = await loop.run_in_executor(
-                    None, 
-                    lambda: self.bridge.start_stream(stream_key, rtsp_url, camera_name)
-                )
-                
-                await websocket.send(json.dumps({
-                    "type": "stream_started",
-                    "data": {
-                        **result,
-                        "rtsp_url": rtsp_url,
-                        "camera_name": camera_name
-                    }
-                }))
-                
-                # Broadcast para outros clientes
-                if result.get("success"):
-                    await self.broadcast({
-                        "type": "stream_status",
-                        "data": {
-                            "stream_key": stream_key,
-                            "status": "running",
-                            "camera_name": camera_name
-                        }
-                    })
-            
-            elif msg_type == "stop_stream":
-                if not self.bridge:
-                    return
-                
-                stream_key = msg_data.get("stream_key", "")
-                
-                loop = asyncio.get_event_loop()
-                result = await loop.run_in_executor(
-                    None,
-                    lambda: self.bridge.stop_stream(stream_key)
-                )
-                
-                await websocket.send(json.dumps({
-                    "type": "stream_stopped",
-                    "data": result
-                }))
-                
-                if result.get("success"):
-                    await self.broadcast({
-                        "type": "stream_status",
-                        "data": {
-                            "stream_key": stream_key,
-                            "status": "stopped"
-                        }
-                    })
-            
-            elif msg_type == "list_streams":
-                if not self.bridge:
-                    await websocket.send(json.dumps({
-                        "type": "streams_list",
-                        "data": {"streams": []}
-                    }))
-                    return
-                
-                streams = self.bridge.get_all_streams()
-                await websocket.send(json.dumps({
-                    "type": "streams_list",
-                    "data": {"streams": streams}
-                }))
-            
-            elif msg_type == "test_rtsp":
-                # Testa conexão RTSP localmente
-                rtsp_url = msg_data.get("rtsp_url", "")
-                
-                if not rtsp_url:
-                    await websocket.send(json.dumps({
-                        "type": "rtsp_test_result",
-                        "data": {
-                            "success": False,
-                            "error": "URL RTSP não fornecida",
-                            "rtsp_url": rtsp_url
-                        }
-                    }))
-                    return
-                
-                # Testa conexão em thread separada
-                loop = asyncio.get_event_loop()
-                result = await loop.run_in_executor(
-                    None,
-                    lambda: self._test_rtsp_connection(rtsp_url)
-                )
-                
-                await websocket.send(json.dumps({
-                    "type": "rtsp_test_result",
-                    "data": result
-                }))
-            
-            elif msg_type == "start_scan":
-                # Dispara evento para o scanner (será tratado pelo app principal)
-                await self.broadcast({
-                    "type": "scan_command",
-                    "data": {"action": "start"}
-                })
-            
-            elif msg_type == "stop_scan":
-                await self.broadcast({
-                    "type": "scan_command", 
-                    "data": {"action": "stop"}
-                })
-            
+            handler = self._handlers.get(msg_type)
+            if handler:
+                await handler(websocket, msg_data)
             else:
                 logger.warning(f"Tipo de mensagem desconhecido: {msg_type}")
                 
@@ -426,30 +454,144 @@ class BridgeWebSocketServer:
         except Exception as e:
             logger.error(f"Erro ao processar mensagem: {e}")
     
+    async def _handle_get_bridge_info(self, websocket, msg_data: dict):
+        await websocket.send(self._bridge_info_json())
+    
+    async def _handle_start_stream(self, websocket, msg_data: dict):
+        if not self.bridge:
+            await websocket.send(json.dumps({
+                "type": "stream_started",
+                "data": {
+                    "success": False,
+                    "error": "Bridge não inicializado",
+                    "stream_key": msg_data.get("stream_key", "")
+                }
+            }))
+            return
+        
+        stream_key = msg_data.get("stream_key", "")
+        rtsp_url = msg_data.get("rtsp_url", "")
+        camera_name = msg_data.get("camera_name", "")
+        
+        if not stream_key or not rtsp_url:
+            await websocket.send(json.dumps({
+                "type": "stream_started",
+                "data": {
+                    "success": False,
+                    "error": "stream_key e rtsp_url são obrigatórios",
+                    "stream_key": stream_key
+                }
+            }))
+            return
+        
+        # Inicia stream no pool do bridge para não bloquear
+        result = await asyncio.get_running_loop().run_in_executor(
+            self._bridge_executor, self.bridge.start_stream, stream_key, rtsp_url, camera_name
+        )
+        
+        await websocket.send(json.dumps({
+            "type": "stream_started",
+            "data": {
+                **result,
+                "rtsp_url": rtsp_url,
+                "camera_name": camera_name
+            }
+        }))
+        
+        # Broadcast para outros clientes
+        if result.get("success"):
+            await self.broadcast({
+                "type": "stream_status",
+                "data": {
+                    "stream_key": stream_key,
+                    "status": "running",
+                    "camera_name": camera_name
+                }
+            })
+    
+    async def _handle_stop_stream(self, websocket, msg_data: dict):
+        if not self.bridge:
+            return
+        
+        stream_key = msg_data.get("stream_key", "")
+        
+        result = await asyncio.get_running_loop().run_in_executor(
+            self._bridge_executor, self.bridge.stop_stream, stream_key
+        )
+        
+        await websocket.send(json.dumps({
+            "type": "stream_stopped",
+            "data": result
+        }))
+        
+        if result.get("success"):
+            await self.broadcast({
+                "type": "stream_status",
+                "data": {
+                    "stream_key": stream_key,
+                    "status": "stopped"
+                }
+            })
+    
+    async def _handle_list_streams(self, websocket, msg_data: dict):
+        streams = self.bridge.get_all_streams() if self.bridge else []
+        await websocket.send(json.dumps({
+            "type": "streams_list",
+            "data": {"streams": streams}
+        }))
+    
+    async def _handle_test_rtsp(self, websocket, msg_data: dict):
+        # Testa conexão RTSP localmente
+        rtsp_url = msg_data.get("rtsp_url", "")
+        
+        if not rtsp_url:
+            await websocket.send(json.dumps({
+                "type": "rtsp_test_result",
+                "data": {
+                    "success": False,
+                    "error": "URL RTSP não fornecida",
+                    "rtsp_url": rtsp_url
+                }
+            }))
+            return
+        
+        # Testa conexão com I/O assíncrono (sem thread)
+        result = await self._test_rtsp_connection(rtsp_url)
+        
+        await websocket.send(json.dumps({
+            "type": "rtsp_test_result",
+            "data": result
+        }))
+    
+    async def _handle_start_scan(self, websocket, msg_data: dict):
+        # Dispara evento para o scanner (será tratado pelo app principal)
+        await self.broadcast({
+            "type": "scan_command",
+            "data": {"action": "start"}
+        })
+    
+    async def _handle_stop_scan(self, websocket, msg_data: dict):
+        await self.broadcast({
+            "type": "scan_command", 
+            "data": {"action": "stop"}
+        })
+    
     async def start(self):
         """Inicia o servidor WebSocket"""
         if not WEBSOCKETS_AVAILABLE:
             logger.error("Biblioteca websockets não disponível")
             return
         
+        self._loop = asyncio.get_running_loop()
+        
+        # Eager tasks (Python 3.12+): create_task executa até a primeira suspensão
+        # sem esperar uma iteração extra do loop
+        if hasattr(asyncio, "eager_task_factory"):
+            self._loop.set_task_factory(asyncio.eager_task_factory)
+        
         # Sinaliza que pode estar instalando FFmpeg
         self._ffmpeg_installing = True
         
-        # Callback para progresso do FFmpeg
-        def ffmpeg_progress_sync(msg, pct):
-            try:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    asyncio.run_coroutine_threadsafe(
-                        self.broadcast({
-                            "type": "ffmpeg_install_progress",
-                            "data": {"message": msg, "percent": pct}
-                        }),
-                        loop
-                    )
-            except:
-                pass
-        
         # Tentar usar HLS Relay primeiro (menor latência)
         if HLS_RELAY_AVAILABLE:
             try:
@@ -457,7 +599,7 @@ class BridgeWebSocketServer:
                 self.bridge = HLSRelayBridge(
                     relay_server_url=self.relay_server_url,
                     on_status_change=self.on_stream_status_change,
-                    on_ffmpeg_progress=ffmpeg_progress_sync
+                    on_ffmpeg_progress=self.on_ffmpeg_progress
                 )
                 self.bridge_mode = "hls-relay"
                 logger.info("✓ HLS Relay Bridge inicializado")
@@ -471,7 +613,7 @@ class BridgeWebSocketServer:
             self.bridge = StreamBridge(
                 rtmp_server_url=self.rtmp_server_url,
                 on_status_change=self.on_stream_status_change,
-                on_ffmpeg_progress=ffmpeg_progress_sync
+                on_ffmpeg_progress=self.on_ffmpeg_progress
             )
             self.bridge_mode = "rtmp-bridge"
             logger.info("✓ RTMP Bridge inicializado")
@@ -479,6 +621,20 @@ class BridgeWebSocketServer:
         self._ffmpeg_installing = False
         self._running = True
         
+        # Campos de bridge_connected que não mudam após a inicialização,
+        # serializados uma vez (sem o "}}" final para anexar os dinâmicos)
+        self._bridge_info_prefix = json.dumps({
+            "type": "bridge_connected",
+            "data": {
+                "client_id": self.client_id,
+                "hostname": self.hostname,
+                "os_info": self.os_info,
+                "bridge_mode": self.bridge_mode,  # "hls-relay" ou "rtmp-bridge"
+                "relay_server_url": self.relay_server_url if self.bridge_mode == "hls-relay" else None,
+            }
+        })[:-2]
+        self.get_local_ip()
+        
         logger.info(f"Iniciando WebSocket server em ws://{self.host}:{self.port}")
         
         try:
@@ -499,6 +655,7 @@ class BridgeWebSocketServer:
                 
                 while self._running:
                     await asyncio.sleep(1)
+                    self._now_iso = _iso_now()
         except Exception as e:
             logger.error(f"Erro no servidor WebSocket: {e}")
     
@@ -508,6 +665,15 @@ class BridgeWebSocketServer:
         
         if self.bridge:
             self.bridge.shutdown()
+        
+        self._bridge_executor.shutdown(wait=False)
+
+
+def run_event_loop(coro):
+    """Executa a coroutine no uvloop/winloop se disponível, senão no asyncio padrão"""
+    if UVLOOP_AVAILABLE:
+        return uvloop.run(coro)
+    return asyncio.run(coro)
 
 
 def run_server(host: str = "0.0.0.0", port: int = 8765):
@@ -515,7 +681,7 @@ def run_server(host: str = "0.0.0.0", port: int = 8765):
     server = BridgeWebSocketServer(host, port)
     
     try:
-        asyncio.run(server.start())
+        run_event_loop(server.start())
     except KeyboardInterrupt:
         logger.info("Servidor encerrado pelo usuário")
         server.stop()
@@ -15,58 +15,268 @@ Modos de operação:
 """
 
 import os
+import re
+import gzip
+import zlib
 import asyncio
+import logging
+import queue
+import signal
+import subprocess
+import time
+from functools import lru_cache
 from pathlib import Path
+from urllib.parse import parse_qsl
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, WebSocket
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, Response
+from logging.handlers import QueueHandler, QueueListener
+from fastapi import FastAPI, HTTPException, Request, WebSocket
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from pydantic import BaseModel
-from typing import Optional
-import aiofiles
-import aiofiles.os
+import orjson
+from typing import Dict, Literal, Optional, Set, Tuple
 
-from stream_manager import StreamManager
+from stream_manager import SEGMENT_SUFFIXES, StreamEntry, StreamManager, install_pidfd_child_watcher
 from websocket_relay import ws_relay, handle_producer, handle_consumer
 
 # Configuração
 HLS_DIR = Path("/tmp/hls")
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 
+# URL pública - calculada uma vez (env não muda em runtime)
+PUBLIC_BASE_URL = os.getenv("RAILWAY_PUBLIC_DOMAIN", "localhost:8080")
+PUBLIC_PROTOCOL = "https" if "railway" in PUBLIC_BASE_URL else "http"
+HLS_URL_TEMPLATE = f"{PUBLIC_PROTOCOL}://{PUBLIC_BASE_URL}/hls/{{}}.m3u8"
+
+# Limites de carga: spawns FFmpeg simultâneos (probe + conexão RTSP) e streams registradas
+MAX_CONCURRENT_STARTS = int(os.getenv("MAX_CONCURRENT_STARTS", min(8, os.cpu_count() or 1)))
+MAX_ACTIVE_STREAMS = int(os.getenv("MAX_ACTIVE_STREAMS", "64"))
+
+logger = logging.getLogger("ivms")
+
 # Gerenciador de streams
-stream_manager = StreamManager(hls_dir=HLS_DIR)
+stream_manager = StreamManager(hls_dir=HLS_DIR, max_concurrent_starts=MAX_CONCURRENT_STARTS)
+
+# Headers da playlist .m3u8 - sempre revalidar (lista deslizante muda a cada segmento).
+# no-cache (sem no-store) permite ao player guardar a cópia e revalidar via ETag/304
+PLAYLIST_HEADERS = {
+    "Cache-Control": "no-cache, must-revalidate, max-age=0",
+    "Pragma": "no-cache",
+    "Expires": "0",
+    "Access-Control-Allow-Origin": "*",
+    "X-Content-Type-Options": "nosniff",
+    "Vary": "Accept-Encoding",
+}
+
+# Headers dos segmentos .ts/.m4s - nomes nunca se repetem (start number por data/epoch),
+# então o conteúdo é imutável e pode ficar em cache de CDN/navegador
+SEGMENT_HEADERS = {
+    "Cache-Control": "public, max-age=31536000, immutable",
+    "Accept-Ranges": "bytes",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Range",
+    "Access-Control-Expose-Headers": "Content-Length, Content-Range",
+}
+
+# CORS sem middleware: headers estáticos nas respostas da API + um handler de preflight
+API_CORS_HEADERS = {"Access-Control-Allow-Origin": "*", "Access-Control-Expose-Headers": "*"}
+PREFLIGHT_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
+    "Access-Control-Allow-Headers": "*",
+    "Access-Control-Max-Age": "86400",  # Cache preflight por 24h
+}
+
+
+class APIResponse(ORJSONResponse):
+    """ORJSONResponse com o header CORS da API"""
+
+    def __init__(self, content=None, status_code: int = 200, headers: Optional[dict] = None, **kwargs):
+        super().__init__(content, status_code, {**API_CORS_HEADERS, **(headers or {})}, **kwargs)
+
+
+# Content-Type por extensão (mimetypes mapeia .ts para TypeScript/Qt e não conhece .m4s)
+SEGMENT_MEDIA_TYPES = {".ts": "video/mp2t", ".m4s": "video/iso.segment", ".mp4": "video/mp4"}
+# init.mp4 mantém o nome entre restarts da stream (codec/resolução podem mudar) - revalidar
+INIT_SEGMENT_HEADERS = {**SEGMENT_HEADERS, "Cache-Control": "no-cache"}
+
+
+# Inicialização de streams FFmpeg: fila consumida por um pool fixo de workers
+START_WORKERS = MAX_CONCURRENT_STARTS
+_start_queue: asyncio.Queue = asyncio.Queue()
+_starting: Set[str] = set()  # stream_keys na fila ou iniciando
+
+
+async def _stream_start_worker():
+    """Worker que consome a fila de streams a iniciar"""
+    while True:
+        stream_key, source_url, name, latency_profile, force_transcode = await _start_queue.get()
+        try:
+            await stream_manager.start_stream(
+                stream_key, source_url, name, latency_profile, force_transcode
+            )
+        except Exception as e:
+            logger.error("❌ Error starting stream %s: %s", stream_key, e)
+        finally:
+            _starting.discard(stream_key)
+            _start_queue.task_done()
+
+
+# Limpeza periódica de segmentos órfãos (FFmpeg morto, RTMP push, relay parado)
+HLS_REAP_INTERVAL = 60    # segundos entre varreduras
+HLS_SEGMENT_MAX_AGE = 300  # .ts/.tmp mais antigos que isso são removidos
+
+
+def _reap_stale_segments() -> int:
+    """Remove segmentos antigos de HLS_DIR (síncrono, roda em thread). Retorna quantos removeu"""
+    removed = 0
+    now = time.time()
+    try:
+        with os.scandir(HLS_DIR) as it:
+            stream_dirs = [entry.path for entry in it if entry.is_dir(follow_symlinks=False)]
+    except FileNotFoundError:
+        return 0
+    
+    for stream_dir in stream_dirs:
+        try:
+            with os.scandir(stream_dir) as it:
+                for f in it:
+                    if not f.name.endswith((*SEGMENT_SUFFIXES, '.tmp')):
+                        continue
+                    try:
+                        if now - f.stat().st_mtime > HLS_SEGMENT_MAX_AGE:
+                            os.unlink(f.path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass  # FFmpeg/nginx já removeu
+        except FileNotFoundError:
+            pass  # Stream removido durante a varredura
+    
+    return removed
+
+
+async def _hls_reaper():
+    """Task de fundo que limita o tamanho de HLS_DIR"""
+    while True:
+        await asyncio.sleep(HLS_REAP_INTERVAL)
+        try:
+            removed = await asyncio.to_thread(_reap_stale_segments)
+            if removed:
+                logger.info("🧹 Removed %s stale HLS segments", removed)
+        except Exception as e:
+            logger.error("❌ Error reaping HLS segments: %s", e)
+
+
+def _hls_dir_fstype() -> Optional[str]:
+    """Tipo do filesystem onde HLS_DIR está montado (ponto de montagem mais longo em /proc/mounts)"""
+    target = os.path.realpath(HLS_DIR)
+    best, fstype = "", None
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount_point = parts[1]
+                if (target == mount_point or target.startswith(mount_point.rstrip("/") + "/")) \
+                        and len(mount_point) > len(best):
+                    best, fstype = mount_point, parts[2]
+    except OSError:
+        return None  # Fora do Linux
+    return fstype
+
+
+_log_listener: Optional[QueueListener] = None
+
+
+def _setup_logging():
+    """
+    Logger do app via fila: no event loop o log é só um put_nowait, a escrita no
+    stdout acontece na thread do QueueListener (formatação %s só se o nível passar)
+    """
+    global _log_listener
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+    _log_listener = QueueListener(log_queue, handler)
+    _log_listener.start()
+
+
+def _stop_logging():
+    """Esvazia a fila de logs e encerra a thread do listener"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+        logger.handlers.clear()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle do app - setup e cleanup"""
     # Startup
+    _setup_logging()
+    if install_pidfd_child_watcher():
+        logger.info("👁️ Child processes watched via pidfd")
     HLS_DIR.mkdir(parents=True, exist_ok=True)
-    print(f"📁 HLS directory: {HLS_DIR}")
-    print(f"🌐 CORS origins: {ALLOWED_ORIGINS}")
+    fstype = _hls_dir_fstype()
+    if fstype and fstype != "tmpfs":
+        # Segmentos são efêmeros: em disco cada write/unlink passa pelo journal
+        logger.warning("⚠️ %s está em %s, não tmpfs - monte um tmpfs para tirar o HLS do disco", HLS_DIR, fstype)
+    workers = [asyncio.create_task(_stream_start_worker()) for _ in range(START_WORKERS)]
+    reaper = asyncio.create_task(_hls_reaper())
+    stream_manager.start_segment_index()
+    stream_manager.start_hw_encoder_probe()
+    logger.info("📁 HLS directory: %s", HLS_DIR)
+    logger.info("🌐 CORS origins: %s", ALLOWED_ORIGINS)
     yield
     # Shutdown
+    reaper.cancel()
+    stream_manager.stop_segment_index()
+    for worker in workers:
+        worker.cancel()
     await stream_manager.stop_all()
-    print("🛑 All streams stopped")
+    logger.info("🛑 All streams stopped")
+    _stop_logging()
 
 
 app = FastAPI(
     title="IVMS Pro Streaming Server",
     description="Servidor de streaming para IVMS Pro",
     version="1.0.0",
+    default_response_class=APIResponse,
     lifespan=lifespan
 )
 
-# CORS - Permitir todas as origens para streaming
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Permitir qualquer origem
-    allow_credentials=False,  # Não usar credentials com wildcard
-    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-    expose_headers=["*"],
-    max_age=86400,  # Cache preflight por 24h
-)
+# CORS - Sem CORSMiddleware (evita uma camada ASGI a mais em toda requisição).
+# Playlist/segmentos já levam Access-Control-Allow-Origin nos headers fixos
+_PREFLIGHT = Response(status_code=204, headers=PREFLIGHT_HEADERS)
+
+
+@app.options("/{path:path}", include_in_schema=False)
+async def cors_preflight(path: str):
+    """Preflight CORS para qualquer rota"""
+    return _PREFLIGHT
+
+
+@app.exception_handler(StarletteHTTPException)
+async def http_exception_handler(request: Request, exc: StarletteHTTPException):
+    """Erros HTTP também precisam do header CORS para o navegador ler o detail"""
+    return APIResponse({"detail": exc.detail}, status_code=exc.status_code, headers=exc.headers)
+
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    """422 com header CORS (mesmo corpo do handler padrão do FastAPI)"""
+    return APIResponse({"detail": jsonable_encoder(exc.errors())}, status_code=422)
 
 
 # ============ Models ============
@@ -75,6 +285,8 @@ class StreamCreate(BaseModel):
     stream_key: str
     source_url: str  # URL RTSP ou RTMP de origem
     name: Optional[str] = None
+    latency_profile: Literal["low", "normal", "fmp4"] = "low"  # Ver HLS_PROFILES no stream_manager
+    force_transcode: bool = False  # Re-encode mesmo se a câmera já entrega H.264 (copy mode)
 
 
 class StreamInfo(BaseModel):
@@ -87,35 +299,77 @@ class StreamInfo(BaseModel):
 
 # ============ Endpoints ============
 
+ROOT_PAYLOAD = {
+    "service": "IVMS Pro Streaming Server",
+    "status": "running",
+    "endpoints": {
+        "streams": "/streams",
+        "hls": "/hls/{stream_key}.m3u8",
+        "health": "/health"
+    }
+}
+# Resposta estática: serializada uma única vez no import
+ROOT_RESPONSE = Response(
+    content=orjson.dumps(ROOT_PAYLOAD), media_type="application/json", headers=API_CORS_HEADERS
+)
+
+
 @app.get("/")
 async def root():
     """Página inicial"""
-    return {
-        "service": "IVMS Pro Streaming Server",
-        "status": "running",
-        "endpoints": {
-            "streams": "/streams",
-            "hls": "/hls/{stream_key}.m3u8",
-            "health": "/health"
-        }
-    }
+    return ROOT_RESPONSE
 
 
 @app.get("/health")
 async def health():
     """Health check"""
-    return {
+    # Response direto: pula jsonable_encoder/validação do FastAPI
+    return APIResponse({
         "status": "healthy",
         "active_streams": len(stream_manager.streams)
-    }
+    })
 
 
-@app.get("/debug/hls")
-async def debug_hls_dir():
-    """Lista todos os diretórios e arquivos HLS - útil para debug"""
-    import os as os_module
-    import time
+def _file_listing(entries: Dict[str, Tuple[int, float]]) -> tuple:
+    """Monta (files, newest_segment_age) a partir de {nome: (size, mtime)}"""
+    files = []
+    newest_segment_age = None
+    now = time.time()
     
+    for name, (size, mtime) in entries.items():
+        age = now - mtime
+        files.append({
+            "name": name,
+            "size": size,
+            "age_seconds": round(age, 1)
+        })
+        
+        # Track newest segment (.ts/.m4s)
+        if name.endswith(SEGMENT_SUFFIXES):
+            if newest_segment_age is None or age < newest_segment_age:
+                newest_segment_age = age
+    
+    return files, newest_segment_age
+
+
+def _stat_dir(path: str) -> Dict[str, Tuple[int, float]]:
+    """{nome: (size, mtime)} de um diretório via scandir; FileNotFoundError se não existe"""
+    entries = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries[entry.name] = (st.st_size, st.st_mtime)
+    return entries
+
+
+def _scan_hls_dir(index: Optional[dict] = None) -> dict:
+    """
+    Varredura síncrona de HLS_DIR (roda fora do event loop via asyncio.to_thread).
+    index: snapshot do índice inotify - diretórios presentes nele não são listados no disco.
+    """
     result = {
         "hls_base_dir": str(HLS_DIR),
         "hls_dir_exists": HLS_DIR.exists(),
@@ -123,27 +377,26 @@ async def debug_hls_dir():
         "all_items": []  # Lista todos os itens no diretório raiz
     }
     
-    if HLS_DIR.exists():
-        now = time.time()
+    if result["hls_dir_exists"]:
+        # Listar TUDO no diretório raiz (scandir: tipo vem do getdents, sem stat extra)
+        with os.scandir(HLS_DIR) as it:
+            entries = list(it)
         
-        # Listar TUDO no diretório raiz
-        for item in HLS_DIR.iterdir():
+        for item in entries:
+            is_dir = item.is_dir(follow_symlinks=False)
             item_info = {
                 "name": item.name,
-                "is_dir": item.is_dir(),
+                "is_dir": is_dir,
                 "size": item.stat().st_size if item.is_file() else None,
             }
             result["all_items"].append(item_info)
             
-            if item.is_dir():
-                files = []
-                for f in item.iterdir():
-                    stat = os_module.stat(f)
-                    files.append({
-                        "name": f.name,
-                        "size": stat.st_size,
-                        "age_seconds": round(now - stat.st_mtime, 1)
-                    })
+            if is_dir:
+                indexed = index.get(item.name) if index is not None else None
+                try:
+                    files, _ = _file_listing(indexed if indexed is not None else _stat_dir(item.path))
+                except FileNotFoundError:
+                    continue
                 result["streams"][item.name] = {
                     "file_count": len(files),
                     "files": sorted(files, key=lambda x: x["age_seconds"])
@@ -156,13 +409,36 @@ async def debug_hls_dir():
     return result
 
 
+def _scan_stream_dir(stream_dir: Path) -> tuple:
+    """
+    Lista arquivos de um stream (síncrono, roda em thread).
+    Retorna (files, newest_segment_age); FileNotFoundError se o diretório não existe.
+    """
+    return _file_listing(_stat_dir(stream_dir))
+
+
+def _nginx_status() -> str:
+    """Verifica se nginx está rodando (pgrep bloqueia - chamar via asyncio.to_thread)"""
+    try:
+        result = subprocess.run(["pgrep", "-x", "nginx"], capture_output=True, timeout=2)
+        return "running" if result.returncode == 0 else "stopped"
+    except:
+        return "unknown"
+
+
+@app.get("/debug/hls")
+async def debug_hls_dir():
+    """Lista todos os diretórios e arquivos HLS - útil para debug"""
+    index = None
+    if stream_manager.segment_index_ready:
+        # Snapshot no event loop (o índice é mutado aqui); a thread só lê a cópia
+        index = {key: dict(files) for key, files in stream_manager.segment_index.items()}
+    return await asyncio.to_thread(_scan_hls_dir, index)
+
+
 @app.get("/debug/stream/{stream_key}")
 async def debug_stream(stream_key: str):
     """Debug endpoint para verificar status de um stream"""
-    import os as os_module
-    import time
-    import subprocess
-    
     stream_info = stream_manager.get_stream_status(stream_key)
     stream_dir = HLS_DIR / stream_key
     
@@ -175,47 +451,32 @@ async def debug_stream(stream_key: str):
     # Verificar se processo FFmpeg está rodando (para streams pull)
     if stream_key in stream_manager.processes:
         process = stream_manager.processes[stream_key]
-        process_running = process.poll() is None
+        process_running = process.returncode is None
     
-    # Verificar diretório HLS criado pelo nginx-rtmp
-    if stream_dir.exists():
-        nginx_hls_exists = True
-        all_files = os_module.listdir(stream_dir)
-        now = time.time()
-        
-        for f in all_files:
-            file_path = stream_dir / f
-            try:
-                stat = os_module.stat(file_path)
-                age = now - stat.st_mtime
-                files.append({
-                    "name": f,
-                    "size": stat.st_size,
-                    "age_seconds": round(age, 1)
-                })
-                
-                # Track newest .ts segment
-                if f.endswith('.ts'):
-                    if newest_segment_age is None or age < newest_segment_age:
-                        newest_segment_age = age
-            except:
-                pass
-        
+    # Verificar diretório HLS criado pelo nginx-rtmp: índice inotify em memória,
+    # ou varredura fora do event loop se o índice não estiver ativo
+    if stream_manager.segment_index_ready:
+        indexed = stream_manager.segment_index.get(stream_key)
+        if indexed is not None:
+            files, newest_segment_age = _file_listing(indexed)
+            nginx_hls_exists = True
+    else:
+        try:
+            files, newest_segment_age = await asyncio.to_thread(_scan_stream_dir, stream_dir)
+            nginx_hls_exists = True
+        except FileNotFoundError:
+            pass
+    
+    if nginx_hls_exists:
         # Tentar ler playlist
         for playlist_name in ["index.m3u8", f"{stream_key}.m3u8"]:
             playlist_path = stream_dir / playlist_name
-            if playlist_path.exists():
-                async with aiofiles.open(playlist_path, mode='r') as f:
-                    playlist_content = await f.read()
+            if stream_manager.segment_exists(stream_key, playlist_name):
+                playlist_content = await asyncio.to_thread(playlist_path.read_text)
                 break
     
     # Verificar se nginx está rodando e escutando na porta 1935
-    nginx_status = "unknown"
-    try:
-        result = subprocess.run(["pgrep", "-x", "nginx"], capture_output=True, timeout=2)
-        nginx_status = "running" if result.returncode == 0 else "stopped"
-    except:
-        pass
+    nginx_status = await asyncio.to_thread(_nginx_status)
     
     # Determinar diagnóstico
     mode = stream_info.get("mode") if stream_info else None
@@ -252,78 +513,96 @@ async def debug_stream(stream_key: str):
 
 
 @app.post("/streams", response_model=StreamInfo)
-async def create_stream(stream: StreamCreate, background_tasks: BackgroundTasks):
+async def create_stream(stream: StreamCreate):
     """
     Registra e inicia uma nova stream.
     
     Para RTMP push (source_url vazia): apenas registra e aguarda stream via nginx-rtmp
     Para RTSP/RTMP pull (source_url preenchida): inicia FFmpeg para conversão
     """
-    base_url = os.getenv("RAILWAY_PUBLIC_DOMAIN")
-    protocol = "https" if "railway" in base_url else "http"
+    # Limite de streams - recusar novas (re-registro da mesma key é permitido).
+    # União: a key iniciando já entra em streams ("starting") antes de sair de _starting
+    active = stream_manager.streams.keys() | _starting
+    if stream.stream_key not in active and len(active) >= MAX_ACTIVE_STREAMS:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Limite de {MAX_ACTIVE_STREAMS} streams ativas atingido",
+            headers={"Retry-After": "30"},
+        )
     
     # Se source_url está vazia, é um stream RTMP push (OBS/câmera envia diretamente)
     if not stream.source_url or stream.source_url.strip() == "":
-        print(f"📡 RTMP push mode: registrando {stream.stream_key} (aguardando conexão)")
+        logger.info("📡 RTMP push mode: registrando %s (aguardando conexão)", stream.stream_key)
         
         # Criar diretório HLS para nginx-rtmp usar
         stream_dir = HLS_DIR / stream.stream_key
         stream_dir.mkdir(parents=True, exist_ok=True)
         
         # Registrar stream como "waiting" - nginx-rtmp vai atualizar quando receber
-        stream_manager.streams[stream.stream_key] = {
-            "name": stream.name,
-            "source_url": "",
-            "status": "waiting",  # Aguardando conexão RTMP
-            "mode": "rtmp-push",
-            "dir": str(stream_dir),
-            "start_time": __import__('time').time(),
-            "restart_count": 0,
-        }
+        async with stream_manager.lock:
+            stream_manager.streams[stream.stream_key] = StreamEntry(
+                name=stream.name,
+                source_url="",
+                status="waiting",  # Aguardando conexão RTMP
+                mode="rtmp-push",
+                dir=str(stream_dir),
+            )
         
         return StreamInfo(
             stream_key=stream.stream_key,
             name=stream.name,
             source_url="",
             status="waiting",
-            hls_url=f"{protocol}://{base_url}/hls/{stream.stream_key}.m3u8"
+            hls_url=HLS_URL_TEMPLATE.format(stream.stream_key)
         )
     
-    # Se já existe, parar antes de reiniciar
-    if stream.stream_key in stream_manager.streams:
-        print(f"⚠️ Stream {stream.stream_key} já existe, parando para reiniciar...")
-        await stream_manager.stop_stream(stream.stream_key)
-    
-    # Inicia conversão FFmpeg em background
-    background_tasks.add_task(
-        stream_manager.start_stream,
-        stream.stream_key,
-        stream.source_url,
-        stream.name
-    )
+    # Lock só para checar/marcar o registro: o stop abaixo (até ~5s) roda fora dele e
+    # não segura os callbacks do nginx-rtmp nem o relay de outras câmeras
+    async with stream_manager.lock:
+        duplicate = stream.stream_key in _starting
+        if not duplicate:
+            # Marcado como iniciando antes do stop: uma duplicata concorrente é ignorada
+            _starting.add(stream.stream_key)
+            restart = stream.stream_key in stream_manager.streams
+    
+    # Já está na fila ou iniciando - não enfileirar de novo
+    if duplicate:
+        logger.warning("⚠️ Stream %s já está iniciando, ignorando duplicata", stream.stream_key)
+    else:
+        # Se já existe, parar antes de reiniciar
+        if restart:
+            logger.warning("⚠️ Stream %s já existe, parando para reiniciar...", stream.stream_key)
+            try:
+                await stream_manager.stop_stream(stream.stream_key)
+            except BaseException:
+                _starting.discard(stream.stream_key)
+                raise
+        
+        # Inicia conversão FFmpeg pelos workers
+        _start_queue.put_nowait(
+            (stream.stream_key, stream.source_url, stream.name,
+             stream.latency_profile, stream.force_transcode)
+        )
     
     return StreamInfo(
         stream_key=stream.stream_key,
         name=stream.name,
         source_url=stream.source_url,
         status="starting",
-        hls_url=f"{protocol}://{base_url}/hls/{stream.stream_key}.m3u8"
+        hls_url=HLS_URL_TEMPLATE.format(stream.stream_key)
     )
 
 
 @app.get("/streams")
 async def list_streams():
     """Lista todas as streams ativas"""
-    base_url = os.getenv("RAILWAY_PUBLIC_DOMAIN", "localhost:8080")
-    protocol = "https" if "railway" in base_url else "http"
-    
     streams = []
     for key, info in stream_manager.streams.items():
         streams.append({
             "stream_key": key,
-            "name": info.get("name"),
-            "status": info.get("status", "unknown"),
-            "hls_url": f"{protocol}://{base_url}/hls/{key}.m3u8"
+            "name": info.name,
+            "status": info.status,
+            "hls_url": HLS_URL_TEMPLATE.format(key)
         })
     return {"streams": streams}
 
@@ -338,34 +617,191 @@ async def delete_stream(stream_key: str):
     return {"message": "Stream removida", "stream_key": stream_key}
 
 
-@app.get("/hls/{stream_key}.m3u8")
-async def get_playlist(stream_key: str):
-    """Retorna a playlist HLS (.m3u8) com paths corrigidos - ANTI-CACHE"""
-    import time
+# Entrada de segmento na playlist: tags do segmento (#EXTINF, #EXT-X-PROGRAM-DATE-TIME,
+# #EXT-X-BYTERANGE) + linha do .ts/.m4s (+ quebra de linha). As tags só são emitidas junto
+# com o segmento, num único passe. Opera direto nos bytes do arquivo - sem decode/encode
+_SEGMENT_ENTRY = re.compile(
+    rb'^((?:#EXT(?:INF|-X-PROGRAM-DATE-TIME|-X-BYTERANGE)[^\n]*\n)*)([^\s#][^\n]*\.(?:ts|m4s))(\n|$)',
+    re.MULTILINE,
+)
+# Header de inicialização do fMP4 (#EXT-X-MAP:URI="init.mp4") - URI relativa ao diretório
+_MAP_URI = re.compile(rb'(#EXT-X-MAP:URI=")([^"/]+")')
+
+
+def _rewrite_playlist(stream_key: str, content: bytes) -> tuple:
+    """
+    Ajusta paths dos segmentos para incluir o stream_key e remove segmentos
+    que (ainda) não existem. Retorna (corpo em bytes, segmentos ausentes, nº válidos)
+    """
+    prefix = f"{stream_key}/".encode()
+    missing = []
+    valid_segments = 0
+    
+    def adjust(match):
+        nonlocal valid_segments
+        segment_tags, segment, newline = match.groups()
+        name = segment.decode(errors="replace")
+        if stream_manager.segment_exists(stream_key, name):
+            # URL estável (sem cache-buster) - permite cache de CDN/P2P
+            valid_segments += 1
+            return segment_tags + prefix + segment + newline
+        # Segmento não existe mais - remover junto com as tags dele
+        missing.append(name)
+        return b""
     
+    body = _SEGMENT_ENTRY.sub(adjust, content)
+    if b"#EXT-X-MAP" in body:
+        body = _MAP_URI.sub(lambda m: m.group(1) + prefix + m.group(2), body)
+    return body, tuple(missing), valid_segments
+
+
+@lru_cache(maxsize=64)
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """Accept-Encoding aceita gzip? Respeita q=0 ("gzip;q=0" recusa explicitamente)"""
+    # Poucos valores distintos (um por navegador/player): parse cacheado por string
+    wildcard = False
+    for token in accept_encoding.lower().split(","):
+        coding, _, params = token.partition(";")
+        coding = coding.strip()
+        if coding not in ("gzip", "*"):
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding == "gzip":
+            return q > 0
+        wildcard = q > 0
+    return wildcard
+
+
+async def _load_playlist(stream_key: str, playlist_path: Path, playlist_stat=None) -> tuple:
+    """Lê e reescreve a playlist do disco, guardando o resultado no playlist_cache"""
+    try:
+        if playlist_stat is None:
+            playlist_stat = os.stat(playlist_path)
+        content = await asyncio.to_thread(playlist_path.read_bytes)
+    except FileNotFoundError:
+        # Removida entre o stat e a leitura (restart/unregister)
+        raise HTTPException(status_code=404, detail="Stream não encontrada ou ainda iniciando")
+    
+    version = (playlist_path.name, playlist_stat.st_mtime_ns, playlist_stat.st_size)
+    body, missing, valid_segments = _rewrite_playlist(stream_key, content)
+    # ETag do corpo reescrito: re-poll sem mudança vira 304 sem corpo
+    etag = f'"{zlib.crc32(body):08x}-{len(body):x}"'
+    # Versão gzip comprimida uma vez por playlist, servida a todos os viewers (ETag próprio)
+    gz_body = gzip.compress(body, compresslevel=1, mtime=0)
+    gz_headers = {**PLAYLIST_HEADERS, "ETag": etag[:-1] + '-gz"', "Content-Encoding": "gzip"}
+    cached = (
+        version, body, missing, valid_segments, {**PLAYLIST_HEADERS, "ETag": etag},
+        gz_body, gz_headers,
+    )
+    
+    # Duas recargas concorrentes: não deixar a mais antiga sobrescrever a mais nova
+    current = stream_manager.playlist_cache.get(stream_key)
+    if stream_key in stream_manager.streams and (
+        current is None or current[0][1] <= version[1]
+    ):
+        stream_manager.playlist_cache[stream_key] = cached
+    return cached
+
+
+async def _refresh_playlist(stream_key: str, playlist_path: Path):
+    """Recarga disparada pelo inotify - erros só significam que a stream sumiu no meio"""
+    try:
+        await _load_playlist(stream_key, playlist_path)
+    except HTTPException:
+        pass
+    except Exception as e:
+        logger.warning("⚠️ Error refreshing playlist %s: %s", stream_key, e)
+
+
+def _on_playlist_write(stream_key: str, playlist_path: Path):
+    """playlist_listener do índice: reescreve a playlist uma vez por gravação do FFmpeg/nginx/relay"""
+    if stream_key in stream_manager.streams:
+        asyncio.create_task(_refresh_playlist(stream_key, playlist_path))
+
+
+stream_manager.playlist_listener = _on_playlist_write
+
+
+async def _playlist_from_disk(stream_key: str, cached: Optional[tuple]) -> tuple:
+    """Localiza a playlist no disco e recarrega o cache se a versão mudou (sem índice inotify)"""
     stream_dir = HLS_DIR / stream_key
+    entry = stream_manager.streams.get(stream_key)
     
     # Tentar encontrar playlist - pode ser index.m3u8 ou {stream_key}.m3u8
+    # (EAFP: o stat serve de checagem de existência e já traz mtime/size).
+    # O nome já descoberto vem primeiro: na maioria das requests é um único stat
     playlist_path = None
+    playlist_stat = None
     possible_names = ["index.m3u8", f"{stream_key}.m3u8", "playlist.m3u8"]
+    if entry is not None and entry.playlist_name:
+        possible_names.insert(0, entry.playlist_name)
     
     for name in possible_names:
         candidate = stream_dir / name
-        if candidate.exists():
-            playlist_path = candidate
-            break
+        try:
+            playlist_stat = os.stat(candidate)
+        except FileNotFoundError:
+            continue
+        playlist_path = candidate
+        break
     
-    # Se não encontrou por nome, procurar qualquer .m3u8
-    if not playlist_path and stream_dir.exists():
-        m3u8_files = list(stream_dir.glob("*.m3u8"))
-        if m3u8_files:
-            playlist_path = m3u8_files[0]
+    # Se não encontrou por nome, procurar qualquer .m3u8 (scandir + endswith, sem fnmatch)
+    if not playlist_path:
+        try:
+            with os.scandir(stream_dir) as it:
+                for dirent in it:
+                    if not dirent.name.endswith('.m3u8'):
+                        continue
+                    try:
+                        playlist_stat = dirent.stat()
+                    except FileNotFoundError:
+                        continue
+                    playlist_path = Path(dirent.path)
+                    break
+        except FileNotFoundError:
+            pass
     
-    if not playlist_path or not playlist_path.exists():
+    if not playlist_path:
         raise HTTPException(status_code=404, detail="Stream não encontrada ou ainda iniciando")
+    if entry is not None:
+        entry.playlist_name = playlist_path.name
+    
+    # Reler e reescrever apenas quando a playlist mudou
+    version = (playlist_path.name, playlist_stat.st_mtime_ns, playlist_stat.st_size)
+    if (
+        cached
+        and cached[0] == version
+        and not any(stream_manager.segment_exists(stream_key, name) for name in cached[2])
+    ):
+        return cached
+    return await _load_playlist(stream_key, playlist_path, playlist_stat)
+
+
+@app.get("/hls/{stream_key}.m3u8")
+async def get_playlist(stream_key: str, request: Request):
+    """Retorna a playlist HLS (.m3u8) com paths corrigidos - ANTI-CACHE"""
+    # Todo stream servível está no registro (push/pull/relay) - 404 sem tocar no disco
+    if stream_key not in stream_manager.streams:
+        raise HTTPException(status_code=404, detail="Stream não encontrada ou ainda iniciando")
+    
+    cached = stream_manager.playlist_cache.get(stream_key)
+    if not (cached and stream_manager.segment_index_ready):
+        cached = await _playlist_from_disk(stream_key, cached)
+    elif any(stream_manager.segment_exists(stream_key, name) for name in cached[2]):
+        # Cache mantido pelo inotify, mas um segmento que faltava chegou depois da playlist
+        cached = await _load_playlist(stream_key, HLS_DIR / stream_key / cached[0][0])
+    
+    version, adjusted_content, _, valid_segments, headers, gz_content, gz_headers = cached
     
     # Verificar idade da playlist - se muito antiga, stream provavelmente parou
-    playlist_age = time.time() - playlist_path.stat().st_mtime
+    playlist_age = time.time() - version[1] / 1e9
     if playlist_age > 30:
         # Playlist não foi atualizada em 30s - stream provavelmente morreu
         raise HTTPException(
@@ -373,71 +809,52 @@ async def get_playlist(stream_key: str):
             detail=f"Stream inativo (playlist não atualizada há {int(playlist_age)}s)"
         )
     
-    async with aiofiles.open(playlist_path, mode='r') as f:
-        content = await f.read()
-    
-    # Ajustar paths dos segmentos para incluir o stream_key
-    # E verificar se os segmentos existem
-    lines = content.split('\n')
-    adjusted_lines = []
-    valid_segments = 0
-    
-    for line in lines:
-        if line.endswith('.ts'):
-            segment_path = stream_dir / line
-            if segment_path.exists():
-                # Adicionar timestamp para evitar cache de segmentos
-                adjusted_lines.append(f"{stream_key}/{line}?_={int(time.time() * 1000)}")
-                valid_segments += 1
-            else:
-                # Segmento não existe mais - pular (não adicionar linha anterior também)
-                # Remover a linha EXTINF anterior se foi adicionada
-                if adjusted_lines and adjusted_lines[-1].startswith('#EXTINF'):
-                    adjusted_lines.pop()
-        else:
-            adjusted_lines.append(line)
-    
     if valid_segments == 0:
         raise HTTPException(status_code=404, detail="Nenhum segmento válido encontrado")
     
-    adjusted_content = '\n'.join(adjusted_lines)
+    if _accepts_gzip(request.headers.get("accept-encoding", "")):
+        adjusted_content, headers = gz_content, gz_headers
+    
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
     
     return Response(
         content=adjusted_content,
         media_type="application/vnd.apple.mpegurl",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate, max-age=0",
-            "Pragma": "no-cache",
-            "Expires": "0",
-            "Access-Control-Allow-Origin": "*",
-            "X-Content-Type-Options": "nosniff",
-        }
+        headers=headers,
     )
 
 
-@app.get("/hls/{stream_key}/{segment}")
-async def get_segment(stream_key: str, segment: str):
-    """Retorna um segmento de vídeo (.ts) - permite cache curto"""
-    # Remover query string do nome do segmento se existir
-    segment_name = segment.split('?')[0]
-    segment_path = HLS_DIR / stream_key / segment_name
-    
-    if not segment_path.exists():
-        raise HTTPException(status_code=404, detail="Segmento não encontrado")
+class SegmentFiles(StaticFiles):
+    """StaticFiles dos segmentos .ts/.m4s - Range/sendfile do Starlette + headers de cache imutável"""
     
-    return FileResponse(
-        segment_path,
-        media_type="video/mp2t",
-        headers={
-            # Segmentos podem ter cache curto (já são imutáveis uma vez criados)
-            "Cache-Control": "public, max-age=2",
-            "Access-Control-Allow-Origin": "*",
-        }
-    )
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        suffix = os.path.splitext(full_path)[1]
+        response.headers.update(INIT_SEGMENT_HEADERS if suffix == ".mp4" else SEGMENT_HEADERS)
+        media_type = SEGMENT_MEDIA_TYPES.get(suffix)
+        if media_type:
+            response.headers["Content-Type"] = media_type
+        return response
+
+
+# Segmentos servidos direto pelo StaticFiles (sem dispatch de rota por .ts).
+# Registrado depois da rota da playlist para que /hls/{stream_key}.m3u8 tenha prioridade.
+# check_dir=False: HLS_DIR é criado no lifespan
+app.mount("/hls", SegmentFiles(directory=str(HLS_DIR), check_dir=False), name="hls")
 
 
 # ============ RTMP Push Callbacks (nginx-rtmp) ============
 
+# nginx-rtmp só olha o status (2xx = aceita) - resposta vazia e imutável, criada uma vez
+_RTMP_OK = Response(status_code=204)
+
+async def _rtmp_form(request: Request) -> dict:
+    """Campos do callback nginx-rtmp (sempre urlencoded e pequeno - sem parser multipart)"""
+    body = await request.body()
+    return dict(parse_qsl(body.decode("ascii", "replace")))
+
+
 @app.post("/rtmp/on_publish")
 async def rtmp_on_publish(request: Request):
     """
@@ -445,33 +862,31 @@ async def rtmp_on_publish(request: Request):
     nginx-rtmp envia dados como form-urlencoded.
     """
     try:
-        form = await request.form()
+        form = await _rtmp_form(request)
         stream_key = form.get("name", "")
         app_name = form.get("app", "")
         addr = form.get("addr", "unknown")
         
-        print(f"📡 RTMP on_publish received: app={app_name}, name={stream_key}, addr={addr}")
+        logger.info("📡 RTMP on_publish received: app=%s, name=%s, addr=%s", app_name, stream_key, addr)
         
         if not stream_key:
-            print("⚠️ No stream key received")
-            return Response(status_code=200)
+            logger.warning("⚠️ No stream key received")
+            return _RTMP_OK
         
         # Se já existe um stream com esse key, limpar tudo primeiro
         existing = stream_manager.streams.get(stream_key)
         if existing:
-            old_mode = existing.get("mode", "unknown")
-            print(f"⚠️ Stream {stream_key} already exists (mode: {old_mode}), cleaning up...")
+            old_mode = existing.mode or "unknown"
+            logger.warning("⚠️ Stream %s already exists (mode: %s), cleaning up...", stream_key, old_mode)
             
             # Se tinha um processo FFmpeg rodando, parar
             if stream_key in stream_manager.processes:
                 process = stream_manager.processes[stream_key]
-                if process.poll() is None:
-                    print(f"   Stopping FFmpeg process PID {process.pid}")
+                if process.returncode is None:
+                    logger.info("   Stopping FFmpeg process PID %s", process.pid)
                     try:
-                        import signal
-                        import os as os_module
-                        if os_module.name != 'nt':
-                            os_module.killpg(os_module.getpgid(process.pid), signal.SIGKILL)
+                        if os.name != 'nt':
+                            os.killpg(os.getpgid(process.pid), signal.SIGKILL)
                         else:
                             process.kill()
                     except:
@@ -486,24 +901,21 @@ async def rtmp_on_publish(request: Request):
                 del stream_manager.watchdog_tasks[stream_key]
         
         # Registrar/atualizar como stream RTMP push
-        print(f"✅ Registering RTMP push stream: {stream_key}")
-        stream_manager.streams[stream_key] = {
-            "name": stream_key,
-            "source_url": f"rtmp://localhost/live/{stream_key}",
-            "status": "running",
-            "mode": "rtmp-push",  # IMPORTANTE: marcar como RTMP push
-            "dir": str(HLS_DIR / stream_key),
-            "start_time": __import__('time').time(),
-            "restart_count": 0,
-        }
+        logger.info("✅ Registering RTMP push stream: %s", stream_key)
+        async with stream_manager.lock:
+            stream_manager.streams[stream_key] = StreamEntry(
+                name=stream_key,
+                source_url=f"rtmp://localhost/live/{stream_key}",
+                status="running",
+                mode="rtmp-push",  # IMPORTANTE: marcar como RTMP push
+                dir=str(HLS_DIR / stream_key),
+            )
         
-        return Response(status_code=200)
+        return _RTMP_OK
         
     except Exception as e:
-        print(f"❌ Error in on_publish: {e}")
-        import traceback
-        traceback.print_exc()
-        return Response(status_code=200)
+        logger.exception("❌ Error in on_publish: %s", e)
+        return _RTMP_OK
 
 
 @app.post("/rtmp/on_publish_done")
@@ -513,21 +925,22 @@ async def rtmp_on_publish_done(request: Request):
     NÃO remove o stream, apenas marca como parado para permitir reconexão.
     """
     try:
-        form = await request.form()
+        form = await _rtmp_form(request)
         stream_key = form.get("name", "")
         
-        print(f"🛑 RTMP stream ended: {stream_key}")
+        logger.info("🛑 RTMP stream ended: %s", stream_key)
         
         # Apenas atualizar status - NÃO remover para permitir reconexão fácil
-        if stream_key and stream_key in stream_manager.streams:
-            stream_manager.streams[stream_key]["status"] = "waiting"  # Aguardando reconexão
-            stream_manager.streams[stream_key]["last_disconnect"] = __import__('time').time()
+        entry = stream_manager.streams.get(stream_key) if stream_key else None
+        if entry:
+            entry.status = "waiting"  # Aguardando reconexão
+            entry.last_disconnect = time.time()
         
-        return Response(status_code=200)
+        return _RTMP_OK
         
     except Exception as e:
-        print(f"❌ Error in on_publish_done: {e}")
-        return Response(status_code=200)
+        logger.error("❌ Error in on_publish_done: %s", e)
+        return _RTMP_OK
 
 
 @app.post("/streams/{stream_key}/reset")
@@ -536,17 +949,15 @@ async def reset_stream(stream_key: str):
     Reseta o estado de um stream para permitir reconexão.
     Útil quando a câmera precisa reconectar mas o estado está inconsistente.
     """
-    print(f"🔄 Resetting stream state: {stream_key}")
+    logger.info("🔄 Resetting stream state: %s", stream_key)
     
     # Limpar processo FFmpeg se existir
     if stream_key in stream_manager.processes:
         process = stream_manager.processes[stream_key]
-        if process.poll() is None:
+        if process.returncode is None:
             try:
-                import signal
-                import os as os_module
-                if os_module.name != 'nt':
-                    os_module.killpg(os_module.getpgid(process.pid), signal.SIGKILL)
+                if os.name != 'nt':
+                    os.killpg(os.getpgid(process.pid), signal.SIGKILL)
                 else:
                     process.kill()
             except:
@@ -563,24 +974,24 @@ async def reset_stream(stream_key: str):
     # Limpar arquivos HLS antigos
     stream_dir = HLS_DIR / stream_key
     if stream_dir.exists():
-        import shutil
         try:
-            shutil.rmtree(stream_dir)
+            await stream_manager.discard_stream_dir(stream_dir)
             stream_dir.mkdir(parents=True, exist_ok=True)
-            print(f"   Cleaned HLS directory for {stream_key}")
+            logger.info("   Cleaned HLS directory for %s", stream_key)
         except Exception as e:
-            print(f"   Error cleaning HLS dir: {e}")
+            logger.warning("   Error cleaning HLS dir: %s", e)
+    
+    stream_manager.playlist_cache.pop(stream_key, None)
     
     # Resetar ou criar entrada do stream
-    stream_manager.streams[stream_key] = {
-        "name": stream_key,
-        "source_url": "",
-        "status": "waiting",
-        "mode": "rtmp-push",
-        "dir": str(stream_dir),
-        "start_time": __import__('time').time(),
-        "restart_count": 0,
-    }
+    async with stream_manager.lock:
+        stream_manager.streams[stream_key] = StreamEntry(
+            name=stream_key,
+            source_url="",
+            status="waiting",
+            mode="rtmp-push",
+            dir=str(stream_dir),
+        )
     
     return {"message": "Stream reset", "stream_key": stream_key, "status": "waiting"}
 
@@ -598,37 +1009,40 @@ async def relay_register(request: Request):
         if not stream_key:
             raise HTTPException(status_code=400, detail="stream_key é obrigatório")
         
-        print(f"📡 Relay stream registered: {stream_key}")
+        logger.info("📡 Relay stream registered: %s", stream_key)
         
         # Criar diretório HLS
         stream_dir = HLS_DIR / stream_key
         stream_dir.mkdir(parents=True, exist_ok=True)
         
         # Registrar stream
-        stream_manager.streams[stream_key] = {
-            "name": name or stream_key,
-            "source_url": "hls-relay",
-            "status": "running",
-            "mode": "hls-relay",
-            "dir": str(stream_dir),
-            "start_time": __import__('time').time(),
-            "restart_count": 0,
-        }
-        
-        base_url = os.getenv("RAILWAY_PUBLIC_DOMAIN", "localhost:8080")
-        protocol = "https" if "railway" in base_url else "http"
+        async with stream_manager.lock:
+            stream_manager.streams[stream_key] = StreamEntry(
+                name=name or stream_key,
+                source_url="hls-relay",
+                status="running",
+                mode="hls-relay",
+                dir=str(stream_dir),
+            )
         
         return {
             "success": True,
             "stream_key": stream_key,
-            "hls_url": f"{protocol}://{base_url}/hls/{stream_key}.m3u8"
+            "hls_url": HLS_URL_TEMPLATE.format(stream_key)
         }
         
     except Exception as e:
-        print(f"❌ Error registering relay: {e}")
+        logger.error("❌ Error registering relay: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _write_atomic(file_path: Path, content: bytes):
+    """Escreve em .tmp e renomeia para o nome final (rename é atômico no filesystem)"""
+    temp_path = file_path.with_suffix('.tmp')
+    temp_path.write_bytes(content)
+    temp_path.rename(file_path)
+
+
 @app.put("/relay/{stream_key}/{filename}")
 async def relay_upload(stream_key: str, filename: str, request: Request):
     """
@@ -643,22 +1057,20 @@ async def relay_upload(stream_key: str, filename: str, request: Request):
     """
     stream_dir = HLS_DIR / stream_key
     
-    # Criar diretório se não existir (auto-registro)
-    if not stream_dir.exists():
-        stream_dir.mkdir(parents=True, exist_ok=True)
-        print(f"📁 Created relay directory: {stream_key}")
-        
-        # Auto-registrar stream se não existir
-        if stream_key not in stream_manager.streams:
-            stream_manager.streams[stream_key] = {
-                "name": stream_key,
-                "source_url": "hls-relay",
-                "status": "running",
-                "mode": "hls-relay",
-                "dir": str(stream_dir),
-                "start_time": __import__('time').time(),
-                "restart_count": 0,
-            }
+    # Stream não registrado (primeiro upload ou servidor reiniciado): criar
+    # diretório e auto-registrar. Checagem em memória - sem stat por upload
+    if stream_key not in stream_manager.streams:
+        async with stream_manager.lock:
+            if stream_key not in stream_manager.streams:
+                stream_dir.mkdir(parents=True, exist_ok=True)
+                logger.info("📁 Created relay directory: %s", stream_key)
+                stream_manager.streams[stream_key] = StreamEntry(
+                    name=stream_key,
+                    source_url="hls-relay",
+                    status="running",
+                    mode="hls-relay",
+                    dir=str(stream_dir),
+                )
     
     file_path = stream_dir / filename
     
@@ -666,17 +1078,14 @@ async def relay_upload(stream_key: str, filename: str, request: Request):
     content = await request.body()
     
     # Escrever arquivo de forma atômica para evitar leituras parciais
-    temp_path = file_path.with_suffix('.tmp')
-    async with aiofiles.open(temp_path, 'wb') as f:
-        await f.write(content)
-    
-    # Renomear para nome final (operação atômica no filesystem)
-    temp_path.rename(file_path)
+    # (write + rename numa única ida ao threadpool)
+    await asyncio.to_thread(_write_atomic, file_path, content)
     
     # Atualizar status do stream
-    if stream_key in stream_manager.streams:
-        stream_manager.streams[stream_key]["status"] = "running"
-        stream_manager.streams[stream_key]["last_segment_time"] = __import__('time').time()
+    entry = stream_manager.streams.get(stream_key)
+    if entry:
+        entry.status = "running"
+        entry.last_segment_time = time.time()
     
     return Response(status_code=200)
 
@@ -684,17 +1093,15 @@ async def relay_upload(stream_key: str, filename: str, request: Request):
 @app.delete("/relay/{stream_key}")
 async def relay_unregister(stream_key: str):
     """Remove registro de um stream HLS Relay"""
-    print(f"🗑️ Relay stream unregistered: {stream_key}")
-    
-    # Limpar diretório
-    stream_dir = HLS_DIR / stream_key
-    if stream_dir.exists():
-        import shutil
-        shutil.rmtree(stream_dir, ignore_errors=True)
+    logger.info("🗑️ Relay stream unregistered: %s", stream_key)
     
     # Remover do registro
-    if stream_key in stream_manager.streams:
-        del stream_manager.streams[stream_key]
+    async with stream_manager.lock:
+        stream_manager.streams.pop(stream_key, None)
+    stream_manager.playlist_cache.pop(stream_key, None)
+    
+    # Limpar diretório (fora do event loop)
+    await stream_manager.discard_stream_dir(HLS_DIR / stream_key)
     
     return {"success": True, "stream_key": stream_key}
 
@@ -705,16 +1112,24 @@ async def relay_status():
     relay_streams = []
     
     for key, info in stream_manager.streams.items():
-        if info.get("mode") == "hls-relay":
+        if info.mode == "hls-relay":
             stream_dir = HLS_DIR / key
-            segment_count = len(list(stream_dir.glob("*.ts"))) if stream_dir.exists() else 0
+            indexed = stream_manager.segment_index.get(key) if stream_manager.segment_index_ready else None
+            if indexed is not None:
+                segment_count = sum(1 for name in indexed if name.endswith(SEGMENT_SUFFIXES))
+            else:
+                try:
+                    with os.scandir(stream_dir) as it:
+                        segment_count = sum(1 for entry in it if entry.name.endswith(SEGMENT_SUFFIXES))
+                except FileNotFoundError:
+                    segment_count = 0
             
             relay_streams.append({
                 "stream_key": key,
-                "name": info.get("name"),
-                "status": info.get("status"),
+                "name": info.name,
+                "status": info.status,
                 "segment_count": segment_count,
-                "last_segment_time": info.get("last_segment_time")
+                "last_segment_time": info.last_segment_time
             })
     
     return {"relay_streams": relay_streams}
@@ -763,4 +1178,12 @@ async def ws_room_status(stream_key: str):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8080)))
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", 8080)),
+        # auto: uvloop/httptools quando instalados (uvicorn[standard] não traz uvloop no Windows)
+        loop="auto",
+        http="auto",
+        access_log=False,
+    )
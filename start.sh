@@ -3,10 +3,30 @@ set -e
 
 # Criar diretórios necessários com permissões corretas
 mkdir -p /tmp/hls
+
+# Segmentos HLS em memória (tmpfs): sem journal/IO de disco a cada segmento.
+# Precisa de CAP_SYS_ADMIN - se o runtime não permitir, segue no /tmp normal
+# (ou monte via runtime: docker run --tmpfs /tmp/hls:size=512m,mode=1777)
+# Fora de container (systemd): /etc/fstab "tmpfs /tmp/hls tmpfs size=512m,mode=1777 0 0"
+# ou /etc/tmpfiles.d/ivms.conf "L+ /tmp/hls - - - - /dev/shm/hls" + "d /dev/shm/hls 1777 - - -"
+if ! grep -qs " /tmp/hls tmpfs " /proc/mounts && [ ! -L /tmp/hls ]; then
+    if mount -t tmpfs -o "size=${HLS_TMPFS_SIZE:-512m},mode=1777" tmpfs /tmp/hls 2>/dev/null; then
+        echo "✅ /tmp/hls mounted as tmpfs (${HLS_TMPFS_SIZE:-512m})"
+    elif [ "$(df -Pk /dev/shm 2>/dev/null | awk 'NR==2 {print $2}')" -ge "${HLS_SHM_MIN_KB:-262144}" ] 2>/dev/null \
+        && rmdir /tmp/hls 2>/dev/null; then
+        # Sem CAP_SYS_ADMIN: /dev/shm já é tmpfs - usar se for grande o bastante (padrão 256MB;
+        # o /dev/shm de 64MB do Docker lotaria com poucas streams e o FFmpeg pararia com ENOSPC)
+        mkdir -p /dev/shm/hls
+        ln -s /dev/shm/hls /tmp/hls
+        echo "✅ /tmp/hls -> /dev/shm/hls (tmpfs)"
+    else
+        echo "⚠️ Could not mount tmpfs on /tmp/hls - using disk-backed /tmp"
+    fi
+fi
 chmod 777 /tmp/hls
 
 # Iniciar nginx-rtmp em background
-echo "🎬 Starting nginx-rtmp server on port 1935..."
+echo "🎬 Starting nginx-rtmp server on port 1935 (HTTP on 8080)..."
 nginx -c /app/nginx.conf -g 'daemon on;' &
 
 # Aguardar nginx iniciar
@@ -24,6 +44,8 @@ else
     cat /var/log/nginx/error.log 2>/dev/null || true
 fi
 
-# Iniciar FastAPI
-echo "🚀 Starting FastAPI server on port 8080..."
-exec uvicorn main:app --host 0.0.0.0 --port 8080
+# Iniciar FastAPI (atrás do nginx, que escuta a porta pública 8080)
+echo "🚀 Starting FastAPI server on 127.0.0.1:8000 (nginx proxy on 8080)..."
+# uvloop + httptools (já vêm no uvicorn[standard]); sem access log por requisição.
+# Um único worker: o registro de streams e os processos FFmpeg vivem na memória do processo
+exec uvicorn main:app --host 127.0.0.1 --port 8000 --loop uvloop --http httptools --no-access-log
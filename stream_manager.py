@@ -4,26 +4,311 @@ Versão ultra-robusta com reconnect automático e watchdog agressivo
 """
 
 import asyncio
-import subprocess
+import logging
 import os
+import random
 import shutil
 import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Callable, Dict, Optional, Tuple
 import signal
+import sys
+
+# inotify (Linux) para manter índice de segmentos em memória - opcional
+try:
+    from asyncinotify import Inotify, Mask
+    INOTIFY_AVAILABLE = True
+except ImportError:
+    INOTIFY_AVAILABLE = False
+
+
+# Filho do logger "ivms" do app: usa o mesmo handler (fila + thread, ver main._setup_logging)
+logger = logging.getLogger("ivms.stream_manager")
+
+# Perfis de latência do HLS gerado: duração do segmento (s), tamanho da playlist e container.
+# "low" = LL-HLS curto (padrão); "normal" = segmentos de 4s / 15 na lista, mais tolerante
+# a rede instável e com menos requests por viewer; "fmp4" = segmentos de 1s em fMP4
+# (CMAF, init.mp4 + .m4s) - menos overhead que MPEG-TS, exige player com suporte a fMP4
+HLS_PROFILES = {
+    "low": {"hls_time": 1, "hls_list_size": 4, "segment_type": "mpegts"},
+    "normal": {"hls_time": 4, "hls_list_size": 15, "segment_type": "mpegts"},
+    "fmp4": {"hls_time": 1, "hls_list_size": 6, "segment_type": "fmp4"},
+}
+# Encoder de hardware do re-encode: "auto" (detecta nvenc > qsv > vaapi), um deles fixo, ou "none".
+# IVMS_FORCE_ENCODER (ex.: libx264 em CI) tem prioridade sobre HW_ENCODER
+HW_ENCODER = (os.getenv("IVMS_FORCE_ENCODER") or os.getenv("HW_ENCODER", "auto")).lower()
+HW_ENCODER_CANDIDATES = ("nvenc", "qsv", "vaapi")
+VAAPI_DEVICE = os.getenv("VAAPI_DEVICE", "/dev/dri/renderD128")
+# NVENC VBR com lookahead + AQ espacial/temporal (maxrate limita o pico). Sem B-frames:
+# latência continua baixa. GPUs antigas (pré-Turing) recusam temporal-aq -> fica no CBR
+NVENC_VBR_ARGS = (
+    "-rc", "vbr", "-cq", "24",
+    "-rc-lookahead", "8", "-spatial-aq", "1", "-temporal-aq", "1", "-aq-strength", "8",
+    "-bf", "0", "-b_ref_mode", "0",
+)
+NVENC_CBR_ARGS = ("-rc", "cbr", "-zerolatency", "1")
+# Preset do libx264 (fallback sem GPU): veryfast comprime bem melhor que ultrafast com
+# o mesmo tempo real em 480p - metade do bitrate. Máquinas no limite de CPU: X264_PRESET=ultrafast
+X264_PRESET = os.getenv("X264_PRESET", "veryfast")
+# Teto de threads por FFmpeg no libx264 - o resto das CPUs é dividido entre as streams ativas
+X264_MAX_THREADS = 4
+
+# Início fixo do comando FFmpeg: opções globais para stream contínuo (LOW LATENCY)
+# + opções de entrada. Montado uma vez; _build_ffmpeg_command só copia a tupla
+_FFMPEG_GLOBAL_ARGS = (
+    # -nostats: sem a linha de progresso (frame=... fps=...) a cada ~0.5s no stderr;
+    # warning (não error) mantém no tail os avisos de RTSP/timestamps úteis no erro
+    "ffmpeg", "-y", "-hide_banner", "-nostats", "-loglevel", "warning",
+    "-fflags", "+genpts+discardcorrupt+nobuffer+flush_packets",
+    "-flags", "low_delay",
+    "-strict", "experimental",
+    "-avioflags", "direct",
+)
+_FFMPEG_PREFIX = _FFMPEG_GLOBAL_ARGS + (
+    "-analyzeduration", "500000",    # 0.5s análise
+    "-probesize", "500000",          # 500KB probe
+)
+_FFMPEG_RTSP_PREFIX = _FFMPEG_GLOBAL_ARGS + (
+    "-rtsp_transport", "tcp",
+    "-rtsp_flags", "prefer_tcp",
+    "-timeout", "5000000",           # 5 segundos timeout
+    "-buffer_size", "512000",        # Buffer menor
+    "-max_delay", "0",               # Sem delay
+    "-reorder_queue_size", "0",      # Sem reorder
+    "-analyzeduration", "500000",    # 0.5s análise
+    "-probesize", "500000",          # 500KB probe
+)
+
+# Resultado do ffprobe por URL reaproveitado por este tempo (s) - restarts não re-probam
+PROBE_CACHE_TTL = 60
+
+# Re-encode na GPU: FFmpeg que sai antes disso volta na hora para libx264, e a fonte
+# fica no libx264 por HW_FALLBACK_TTL (s) - câmera offline também derruba o start
+HW_STARTUP_GRACE = 5
+HW_FALLBACK_TTL = 600
+
+# Atraso aleatório extra (s) somado ao backoff do restart: câmeras que caem juntas
+# (queda de rede/NVR) não reconectam todas no mesmo instante
+RESTART_JITTER = 3.0
+
+# Prefixo dos diretórios descartados (renomeados e apagados em background) - fora do índice
+DISCARDED_DIR_PREFIX = "."
+
+# Extensões de segmento de mídia (MPEG-TS e fMP4) - init.mp4 não entra: é reescrito só no start
+SEGMENT_SUFFIXES = (".ts", ".m4s")
+REENCODE_FPS = 25
+
+# Últimas linhas do stderr do FFmpeg guardadas por processo (o resto é descartado)
+STDERR_TAIL_LINES = 64
+STDERR_LINE_MAX = 500  # bytes por linha guardada
+
+# Eventos inotify observados (sem IN_ACCESS/IN_MODIFY: um evento por arquivo, não por write)
+if INOTIFY_AVAILABLE:
+    _HLS_ROOT_EVENTS = Mask.CREATE | Mask.MOVED_TO | Mask.DELETE | Mask.MOVED_FROM | Mask.ONLYDIR
+    _STREAM_DIR_EVENTS = (
+        Mask.CREATE | Mask.CLOSE_WRITE | Mask.MOVED_TO | Mask.DELETE | Mask.MOVED_FROM | Mask.ONLYDIR
+    )
+
+
+@dataclass(slots=True)
+class StreamEntry:
+    """Estado de uma stream registrada (slots: sem dict por entrada)"""
+    name: Optional[str]
+    source_url: str
+    status: str
+    dir: str
+    mode: Optional[str] = None
+    latency_profile: str = "low"
+    force_transcode: bool = False
+    start_time: float = field(default_factory=time.time)
+    restart_count: int = 0
+    pid: Optional[int] = None
+    error: Optional[str] = None
+    last_segment_time: Optional[float] = None
+    last_disconnect: Optional[float] = None
+    playlist_name: Optional[str] = None  # Nome do .m3u8 descoberto no diretório (fixo por stream)
+
+
+def install_pidfd_child_watcher() -> bool:
+    """
+    Python < 3.12 no loop padrão do asyncio: troca o ThreadedChildWatcher (uma thread
+    bloqueada em waitpid por FFmpeg) pelo PidfdChildWatcher - saída do processo chega
+    como fd legível no próprio event loop. 3.12+ já usa pidfd sozinho; uvloop tem o seu
+    """
+    if sys.version_info >= (3, 12) or not hasattr(asyncio, "PidfdChildWatcher"):
+        return False
+    loop = asyncio.get_running_loop()
+    if not isinstance(loop, asyncio.SelectorEventLoop):
+        return False  # uvloop: libuv já trata SIGCHLD
+    try:
+        os.close(os.pidfd_open(os.getpid()))  # Kernel >= 5.3
+    except (AttributeError, OSError):
+        return False
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+    return True
 
 
 class StreamManager:
     """Gerencia múltiplas streams FFmpeg com watchdog e auto-reconnect"""
     
-    def __init__(self, hls_dir: Path):
+    def __init__(self, hls_dir: Path, max_concurrent_starts: int = 8):
         self.hls_dir = hls_dir
-        self.streams: Dict[str, dict] = {}
-        self.processes: Dict[str, subprocess.Popen] = {}
+        # Limita probes/spawns de FFmpeg simultâneos (inclui restarts do watchdog)
+        self._start_slots = asyncio.Semaphore(max_concurrent_starts)
+        self.streams: Dict[str, StreamEntry] = {}
+        # Serializa check-then-act no registro entre coroutines (endpoints/callbacks)
+        self.lock = asyncio.Lock()
+        self.processes: Dict[str, asyncio.subprocess.Process] = {}
         self.watchdog_tasks: Dict[str, asyncio.Task] = {}
+        # Índice de arquivos HLS mantido por inotify: stream_key -> {nome: (size, mtime)}
+        self.segment_index: Dict[str, Dict[str, Tuple[int, float]]] = {}
+        self.segment_index_ready = False
+        self._index_task: Optional[asyncio.Task] = None
+        # Cache das playlists já reescritas (preenchido pelo endpoint /hls e pelo playlist_listener):
+        # stream_key -> ((nome, mtime_ns, size), corpo em bytes, segmentos ausentes, nº válidos,
+        #                headers c/ ETag, corpo gzip, headers do gzip)
+        # Invalidado quando o arquivo muda (versão), quando um segmento que faltava
+        # chega (relay envia playlist antes dos .ts) e quando a stream para/reinicia
+        self.playlist_cache: Dict[str, Tuple[tuple, bytes, Tuple[str, ...], int, dict, bytes, dict]] = {}
+        # Detecção do encoder de hardware (roda uma vez, na primeira stream com re-encode)
+        self._hw_encoder_task: Optional[asyncio.Task] = None
+        # source_url -> (timestamp, resultado do _probe_stream); só probes bem-sucedidos
+        self._probe_cache: Dict[str, Tuple[float, dict]] = {}
+        # Fontes em que o re-encode na GPU morreu no start - restarts vão direto para libx264
+        self._hw_failed_sources: Dict[str, float] = {}
+        self._nvenc_vbr = False  # GPU aceita NVENC_VBR_ARGS (definido pela detecção)
+        # Eventos "diretório mudou" por stream, sinalizados pelo índice (start em copy mode espera neles)
+        self._dir_events: Dict[str, asyncio.Event] = {}
+        # Watch inotify atual de cada diretório de stream (eventos de watches antigos são ignorados)
+        self._dir_watches: Dict[str, object] = {}
+        # Remoções de diretórios descartados rodando em background
+        self._cleanup_tasks: set = set()
+        # Chamado pelo índice inotify a cada playlist .m3u8 gravada: (stream_key, caminho)
+        self.playlist_listener: Optional[Callable[[str, Path], None]] = None
+    
+    # ============ Índice de segmentos (inotify) ============
+    
+    def start_segment_index(self):
+        """Inicia a task do índice (chamar com o event loop rodando)"""
+        if INOTIFY_AVAILABLE and self._index_task is None:
+            self._index_task = asyncio.create_task(self._run_segment_index())
+    
+    def stop_segment_index(self):
+        """Para a task do índice"""
+        if self._index_task is not None:
+            self._index_task.cancel()
+            self._index_task = None
+    
+    def _index_stream_dir(self, inotify, stream_dir: Path):
+        """Observa um diretório de stream e carrega o que já existe nele"""
+        if stream_dir.name.startswith(DISCARDED_DIR_PREFIX):
+            return
+        self._dir_watches[stream_dir.name] = inotify.add_watch(stream_dir, _STREAM_DIR_EVENTS)
+        files = self.segment_index.setdefault(stream_dir.name, {})
+        try:
+            with os.scandir(stream_dir) as it:
+                for entry in it:
+                    st = entry.stat()
+                    files[entry.name] = (st.st_size, st.st_mtime)
+        except FileNotFoundError:
+            pass
+        self._notify_dir(stream_dir.name)
+    
+    def _notify_dir(self, stream_key: str):
+        """Acorda quem espera por arquivos novos no diretório da stream"""
+        event = self._dir_events.get(stream_key)
+        if event is not None:
+            event.set()
+    
+    async def _run_segment_index(self):
+        """Mantém segment_index atualizado a partir de eventos inotify em hls_dir/*"""
+        try:
+            self.hls_dir.mkdir(parents=True, exist_ok=True)
+            with Inotify() as inotify:
+                # Raiz: só criação/remoção de diretórios de stream
+                inotify.add_watch(self.hls_dir, _HLS_ROOT_EVENTS)
+                with os.scandir(self.hls_dir) as it:
+                    for entry in it:
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                        if entry.name.startswith(DISCARDED_DIR_PREFIX):
+                            # Sobra de um processo anterior que morreu antes de apagar
+                            self._schedule_removal(Path(entry.path))
+                        else:
+                            self._index_stream_dir(inotify, Path(entry.path))
+                self.segment_index_ready = True
+                logger.info("👁️ Segment index watching %s", self.hls_dir)
+                
+                async for event in inotify:
+                    if event.watch is None:
+                        continue
+                    
+                    if event.watch.path == self.hls_dir:
+                        if event.name is not None and event.mask & Mask.ISDIR:
+                            name = str(event.name)
+                            if event.mask & (Mask.CREATE | Mask.MOVED_TO):
+                                self._index_stream_dir(inotify, event.path)
+                            else:
+                                self.segment_index.pop(name, None)
+                                self._dir_watches.pop(name, None)
+                        continue
+                    
+                    # Watch de um diretório já removido/renomeado (descartado ou recriado com o
+                    # mesmo nome): o caminho dele aponta para o diretório novo - ignorar
+                    stream_key = event.watch.path.name
+                    if self._dir_watches.get(stream_key) is not event.watch:
+                        continue
+                    
+                    if event.name is None:
+                        # IGNORED/DELETE_SELF: diretório do stream removido
+                        self.segment_index.pop(stream_key, None)
+                        self._dir_watches.pop(stream_key, None)
+                        continue
+                    
+                    name = str(event.name)
+                    files = self.segment_index.setdefault(stream_key, {})
+                    if event.mask & (Mask.DELETE | Mask.MOVED_FROM):
+                        files.pop(name, None)
+                    else:
+                        try:
+                            st = os.stat(event.path)
+                            files[name] = (st.st_size, st.st_mtime)
+                        except FileNotFoundError:
+                            files.pop(name, None)
+                            continue
+                        self._notify_dir(stream_key)
+                        # Playlist completa (fechada ou renomeada do .tmp): reescrever uma vez aqui
+                        if (
+                            self.playlist_listener is not None
+                            and name.endswith(".m3u8")
+                            and event.mask & (Mask.CLOSE_WRITE | Mask.MOVED_TO)
+                        ):
+                            self.playlist_listener(stream_key, event.path)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("⚠️ Segment index stopped, falling back to filesystem: %s", e)
+        finally:
+            self.segment_index_ready = False
+            self.segment_index.clear()
+            self._dir_watches.clear()
+    
+    def segment_exists(self, stream_key: str, name: str) -> bool:
+        """Checa existência pelo índice em memória (stat no disco se índice inativo)"""
+        if self.segment_index_ready:
+            return name in self.segment_index.get(stream_key, ())
+        return (self.hls_dir / stream_key / name).exists()
     
     async def _probe_stream(self, source_url: str) -> dict:
-        """Usa ffprobe para detectar codec do stream"""
+        """Usa ffprobe para detectar codec do stream (cache de PROBE_CACHE_TTL por URL)"""
+        cached = self._probe_cache.get(source_url)
+        if cached and time.time() - cached[0] < PROBE_CACHE_TTL:
+            return cached[1]
+        
         cmd = [
             "ffprobe",
             "-v", "error",
@@ -51,156 +336,273 @@ class StreamManager:
                 width = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
                 height = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 0
                 
-                print(f"📹 Stream info: codec={codec}, {width}x{height}")
-                return {"codec": codec, "width": width, "height": height, "copy_ok": codec == "h264"}
+                logger.info("📹 Stream info: codec=%s, %sx%s", codec, width, height)
+                info = {"codec": codec, "width": width, "height": height, "copy_ok": codec == "h264"}
+                self._probe_cache[source_url] = (time.time(), info)
+                return info
             else:
-                print(f"⚠️ Probe returned empty output")
+                logger.warning("⚠️ Probe returned empty output")
         except asyncio.TimeoutError:
-            print(f"⚠️ Probe timeout after 10s")
+            logger.warning("⚠️ Probe timeout after 10s")
         except Exception as e:
-            print(f"⚠️ Probe failed: {e}")
+            logger.warning("⚠️ Probe failed: %s", e)
         
         # Default: não tentar copy mode
         return {"codec": "unknown", "width": 0, "height": 0, "copy_ok": False}
     
+    def start_hw_encoder_probe(self):
+        """Dispara a detecção do encoder no startup - a primeira stream não paga o probe"""
+        if self._hw_encoder_task is None:
+            self._hw_encoder_task = asyncio.create_task(self._detect_hw_encoder())
+    
+    async def _get_hw_encoder(self) -> Optional[str]:
+        """Encoder de hardware utilizável (None = libx264), detectado uma vez por processo"""
+        self.start_hw_encoder_probe()
+        return await asyncio.shield(self._hw_encoder_task)
+    
+    async def _detect_hw_encoder(self) -> Optional[str]:
+        """Testa cada encoder com um encode curto - estar listado no build não garante GPU/driver"""
+        if HW_ENCODER in ("none", "cpu", "off", "libx264", ""):
+            return None
+        candidates = HW_ENCODER_CANDIDATES if HW_ENCODER == "auto" else (HW_ENCODER,)
+        
+        for hw in candidates:
+            if hw == "vaapi" and not os.path.exists(VAAPI_DEVICE):
+                continue
+            if hw == "vaapi":
+                pre, post = ["-vaapi_device", VAAPI_DEVICE], ["-vf", "format=nv12,hwupload", "-c:v", "h264_vaapi"]
+            elif hw in ("nvenc", "qsv"):
+                pre, post = [], ["-c:v", f"h264_{hw}"]
+            else:
+                logger.warning("⚠️ Unknown HW_ENCODER '%s', using libx264", hw)
+                return None
+            if await self._test_encode(pre, post):
+                if hw == "nvenc":
+                    self._nvenc_vbr = await self._test_encode(pre, [*post, *NVENC_VBR_ARGS])
+                logger.info("🚀 Hardware encoder available: %s%s", hw, " (VBR+AQ)" if self._nvenc_vbr else "")
+                return hw
+        
+        logger.info("ℹ️ No hardware encoder available, using libx264")
+        return None
+    
+    @staticmethod
+    async def _test_encode(pre: list, post: list) -> bool:
+        """Encode de teste de 0.2s (lavfi) - True se o FFmpeg terminou sem erro"""
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", *pre,
+            "-f", "lavfi", "-i", "color=size=256x144:duration=0.2", *post,
+            "-f", "null", "-",
+        ]
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+            )
+        except Exception:
+            return False
+        try:
+            return await asyncio.wait_for(proc.wait(), timeout=10) == 0
+        except asyncio.TimeoutError:
+            proc.kill()
+            return False
+    
     def _build_ffmpeg_command(
         self,
         source_url: str,
         output_path: Path,
         stream_dir: Path,
-        use_copy: bool = False
+        use_copy: bool = False,
+        latency_profile: str = "low",
+        hw_encoder: Optional[str] = None
     ) -> list:
         """Constrói comando FFmpeg OTIMIZADO para LL-HLS (Low-Latency HLS)"""
         
-        is_rtsp = source_url.lower().startswith("rtsp://")
+        profile = HLS_PROFILES.get(latency_profile, HLS_PROFILES["low"])
+        # GOP alinhado ao segmento: cada segmento começa num keyframe
+        gop = str(REENCODE_FPS * profile["hls_time"])
         
-        cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "warning"]
+        is_rtsp = source_url.lower().startswith("rtsp://")
         
-        # Opções globais para stream contínuo - LOW LATENCY
-        cmd.extend([
-            "-fflags", "+genpts+discardcorrupt+nobuffer+flush_packets",
-            "-flags", "low_delay",
-            "-strict", "experimental",
-            "-avioflags", "direct",
-        ])
+        # Prefixo fixo (globais + entrada) pré-montado no import; só o resto varia por chamada
+        cmd = list(_FFMPEG_RTSP_PREFIX if is_rtsp else _FFMPEG_PREFIX)
         
-        # Configurações de entrada otimizadas para baixa latência
-        if is_rtsp:
-            cmd.extend([
-                "-rtsp_transport", "tcp",
-                "-rtsp_flags", "prefer_tcp",
-                "-timeout", "5000000",           # 5 segundos timeout
-                "-buffer_size", "512000",        # Buffer menor
-                "-max_delay", "0",               # Sem delay
-                "-reorder_queue_size", "0",      # Sem reorder
-                "-analyzeduration", "500000",    # 0.5s análise
-                "-probesize", "500000",          # 500KB probe
-            ])
-        else:
-            cmd.extend([
-                "-analyzeduration", "500000",
-                "-probesize", "500000",
-            ])
+        if not use_copy:
+            # Decode na GPU (NVDEC) com frames mantidos em memória CUDA até o NVENC:
+            # decode -> scale_cuda -> encode sem hwdownload/hwupload
+            if hw_encoder == "nvenc":
+                cmd.extend(["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])
+            elif hw_encoder == "vaapi":
+                cmd.extend(["-vaapi_device", VAAPI_DEVICE])
         
         cmd.extend(["-i", source_url])
         
+        fmp4 = profile["segment_type"] == "fmp4"
+        
         if use_copy:
             cmd.extend([
                 "-c:v", "copy",
                 "-an",  # Sem áudio no copy mode
-                "-bsf:v", "h264_mp4toannexb",
+            ])
+            if not fmp4:
+                # Annex B só para MPEG-TS (fMP4 usa avcC no init.mp4). dump_extra repete
+                # SPS/PPS em todo keyframe: câmeras que só mandam os parâmetros no SDP do
+                # RTSP geravam segmentos que o player não decodifica sozinhos
+                cmd.extend(["-bsf:v", "h264_mp4toannexb,dump_extra=freq=keyframe"])
+        elif hw_encoder == "nvenc":
+            cmd.extend([
+                "-vf", "scale_cuda=854:-2",
+                "-c:v", "h264_nvenc",
+                "-preset", "p1",                  # Mais rápido
+                "-tune", "ull",                   # Ultra low latency
+                *(NVENC_VBR_ARGS if self._nvenc_vbr else NVENC_CBR_ARGS),
+                "-profile:v", "baseline",
+                "-r", str(REENCODE_FPS),
+                "-g", gop,
+                "-forced-idr", "1",
+                "-b:v", "1000k",
+                "-maxrate", "1200k",
+                "-bufsize", "500k",
+                "-an",
+            ])
+        elif hw_encoder == "qsv":
+            cmd.extend([
+                "-vf", "scale=854:-2",
+                "-pix_fmt", "nv12",
+                "-c:v", "h264_qsv",
+                "-preset", "veryfast",
+                "-profile:v", "baseline",
+                "-r", str(REENCODE_FPS),
+                "-g", gop,
+                "-bf", "0",
+                "-b:v", "1000k",
+                "-maxrate", "1200k",
+                "-bufsize", "500k",
+                "-an",
+            ])
+        elif hw_encoder == "vaapi":
+            cmd.extend([
+                "-vf", "scale=854:-2,format=nv12,hwupload",
+                "-c:v", "h264_vaapi",
+                "-profile:v", "constrained_baseline",
+                "-r", str(REENCODE_FPS),
+                "-g", gop,
+                "-bf", "0",
+                "-b:v", "1000k",
+                "-maxrate", "1200k",
+                "-an",
             ])
         else:
             # Re-encoding ULTRA LOW LATENCY para LL-HLS
             cmd.extend([
                 "-c:v", "libx264",
-                "-preset", "ultrafast",           # Mais rápido possível
+                "-preset", X264_PRESET,
                 "-tune", "zerolatency",           # Crítico para baixa latência
                 "-profile:v", "baseline",         # Máxima compatibilidade
                 "-level", "3.1",
                 "-pix_fmt", "yuv420p",
                 "-vf", "scale=854:-2",            # 480p para menor bitrate
-                "-r", "25",                       # 25 fps
-                "-g", "25",                       # GOP = 1s (keyframe a cada segundo)
-                "-keyint_min", "25",              # Keyframe mínimo 1s
+                "-r", str(REENCODE_FPS),
+                "-g", gop,                        # GOP = duração do segmento
+                "-keyint_min", gop,
                 "-sc_threshold", "0",             # Desabilita scene change detection
-                "-b:v", "1000k",
-                "-maxrate", "1200k",
+                "-b:v", "500k",
+                "-maxrate", "700k",
                 "-bufsize", "500k",               # Buffer pequeno = baixa latência
                 "-an",                            # SEM ÁUDIO - evita stalls
-                "-threads", "2",
+                "-threads", str(self._x264_threads()),
             ])
         
         # LL-HLS (Low-Latency HLS) - Configuração completa
         cmd.extend([
             "-f", "hls",
-            "-hls_time", "1",                     # Segmentos de 1s
-            "-hls_list_size", "4",                # 4 segmentos na playlist
-            "-hls_flags", "delete_segments+independent_segments+split_by_time+program_date_time",
-            "-hls_segment_type", "mpegts",
+            "-hls_time", str(profile["hls_time"]),
+            "-hls_list_size", str(profile["hls_list_size"]),
+            # temp_file: segmento é escrito como .tmp e renomeado - nunca servido pela metade
+            "-hls_flags", "delete_segments+independent_segments+split_by_time+program_date_time+temp_file",
+            "-hls_segment_type", profile["segment_type"],
             "-hls_start_number_source", "datetime",
             "-start_number", "1",
-            # LL-HLS específico - partial segments
+            # fMP4: header de inicialização único, referenciado por #EXT-X-MAP
             "-hls_fmp4_init_filename", "init.mp4",
-            "-hls_segment_filename", str(stream_dir / "seg_%d.ts"),
+            "-hls_segment_filename", str(stream_dir / ("seg_%d.m4s" if fmp4 else "seg_%d.ts")),
             str(output_path)
         ])
         
         return cmd
     
+    def _x264_threads(self) -> int:
+        """Threads do libx264 para a próxima stream: CPUs divididas entre os FFmpeg ativos"""
+        # Padrão do libx264 é ~1.5x CPUs por processo: N streams = N vezes isso em threads.
+        # Streams já rodando mantêm o valor do start até o próximo restart
+        cpus = os.cpu_count() or 1
+        return max(1, min(X264_MAX_THREADS, cpus // (len(self.processes) + 1)))
+    
     async def start_stream(
         self,
         stream_key: str,
         source_url: str,
-        name: Optional[str] = None
+        name: Optional[str] = None,
+        latency_profile: str = "low",
+        force_transcode: bool = False
     ):
         """Inicia conversão de RTSP/RTMP para HLS (API pública)"""
         
         # Se já existe e está rodando, retornar
         if stream_key in self.processes:
             process = self.processes[stream_key]
-            if process.poll() is None:
-                print(f"⚠️ Stream {stream_key} já está rodando (PID: {process.pid})")
+            if process.returncode is None:
+                logger.warning("⚠️ Stream %s já está rodando (PID: %s)", stream_key, process.pid)
                 return
         
         # Cancelar watchdog anterior
         await self._cancel_watchdog(stream_key)
         
-        await self._start_stream_internal(stream_key, source_url, name)
+        async with self._start_slots:
+            await self._start_stream_internal(
+                stream_key, source_url, name, latency_profile, force_transcode
+            )
     
     async def _start_stream_internal(
         self,
         stream_key: str,
         source_url: str,
-        name: Optional[str] = None
+        name: Optional[str] = None,
+        latency_profile: str = "low",
+        force_transcode: bool = False
     ):
         """Lógica interna de iniciar stream (chamada por restart também)"""
         
         # Criar/limpar diretório
         stream_dir = self.hls_dir / stream_key
-        if stream_dir.exists():
-            shutil.rmtree(stream_dir, ignore_errors=True)
+        await self.discard_stream_dir(stream_dir)
         stream_dir.mkdir(parents=True, exist_ok=True)
         
         # Preservar restart_count se existir
         restart_count = 0
         if stream_key in self.streams:
-            restart_count = self.streams[stream_key].get("restart_count", 0)
+            restart_count = self.streams[stream_key].restart_count
         
         # Registrar stream
-        self.streams[stream_key] = {
-            "name": name,
-            "source_url": source_url,
-            "status": "starting",
-            "dir": str(stream_dir),
-            "start_time": time.time(),
-            "restart_count": restart_count,
-        }
+        self.playlist_cache.pop(stream_key, None)
+        self.streams[stream_key] = StreamEntry(
+            name=name,
+            source_url=source_url,
+            status="starting",
+            dir=str(stream_dir),
+            latency_profile=latency_profile,
+            force_transcode=force_transcode,
+            restart_count=restart_count,
+        )
         
         output_path = stream_dir / "index.m3u8"
         
-        print(f"🎬 Starting stream: {stream_key}")
-        print(f"📡 Source: {source_url}")
+        logger.info("🎬 Starting stream: %s", stream_key)
+        logger.info("📡 Source: %s", source_url)
+        
+        if force_transcode:
+            # Override explícito: nem roda o ffprobe
+            logger.info("ℹ️ force_transcode set, skipping copy mode")
+            await self._start_with_reencode(stream_key, source_url, output_path, stream_dir)
+            return
         
         # Detectar codec para decidir se tenta copy
         probe_info = await self._probe_stream(source_url)
@@ -211,9 +613,9 @@ class StreamManager:
         
         if not success:
             if probe_info["copy_ok"]:
-                print(f"⚠️ Copy mode failed, trying re-encoding...")
+                logger.warning("⚠️ Copy mode failed, trying re-encoding...")
             else:
-                print(f"ℹ️ Codec '{probe_info['codec']}' requires re-encoding")
+                logger.info("ℹ️ Codec '%s' requires re-encoding", probe_info['codec'])
             await self._start_with_reencode(stream_key, source_url, output_path, stream_dir)
     
     async def _cancel_watchdog(self, stream_key: str, from_watchdog: bool = False):
@@ -252,42 +654,77 @@ class StreamManager:
     ) -> bool:
         """Tenta iniciar com copy mode"""
         
-        cmd = self._build_ffmpeg_command(source_url, output_path, stream_dir, use_copy=True)
-        print(f"🔄 Trying copy mode...")
+        cmd = self._build_ffmpeg_command(
+            source_url, output_path, stream_dir, use_copy=True,
+            latency_profile=self.streams[stream_key].latency_profile
+        )
+        logger.info("🔄 Trying copy mode...")
         
         try:
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
-                preexec_fn=os.setsid if os.name != 'nt' else None
-            )
+            spawned_at = time.time()
+            process = await self._spawn_ffmpeg(cmd)
             
-            # Aguardar até 8 segundos para criar segmento .ts
-            for i in range(16):
-                await asyncio.sleep(0.5)
-                
-                if process.poll() is not None:
-                    stderr = process.stderr.read().decode() if process.stderr else ""
-                    last_error = stderr.split('\n')[-5:] if stderr else []
-                    print(f"❌ Copy mode failed: {''.join(last_error)[-200:]}")
-                    return False
-                
-                # Verificar se há pelo menos um .ts
-                ts_files = list(stream_dir.glob("*.ts"))
-                if len(ts_files) > 0 and output_path.exists():
-                    print(f"✅ Copy mode working!")
-                    self._register_process(stream_key, process, "copy")
-                    return True
+            # Aguardar até 8 segundos para criar segmento + playlist. Com o índice inotify
+            # acorda no próprio evento do arquivo (ou na saída do FFmpeg); sem ele, poll de 0.5s
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + 8
+            try:
+                while True:
+                    changed = asyncio.Event()
+                    self._dir_events[stream_key] = changed
+                    
+                    if process.returncode is not None:
+                        stderr = await self._stderr_tail(process)
+                        last_error = stderr.split('\n')[-5:] if stderr else []
+                        logger.error("❌ Copy mode failed: %s", ''.join(last_error)[-200:])
+                        return False
+                    
+                    if self._output_started(stream_key, stream_dir, output_path, spawned_at):
+                        logger.info("✅ Copy mode working!")
+                        self._register_process(stream_key, process, "copy")
+                        return True
+                    
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    if not self.segment_index_ready:
+                        remaining = min(0.5, remaining)
+                    await self._wait_dir_change(changed, process, remaining)
+            finally:
+                self._dir_events.pop(stream_key, None)
             
-            print(f"⚠️ Copy mode timeout - no segments generated")
+            logger.warning("⚠️ Copy mode timeout - no segments generated")
             self._kill_process(process)
             return False
             
         except Exception as e:
-            print(f"❌ Copy mode error: {e}")
+            logger.error("❌ Copy mode error: %s", e)
             return False
     
+    def _output_started(self, stream_key: str, stream_dir: Path, output_path: Path, since: float) -> bool:
+        """Playlist e pelo menos um segmento já existem (índice em memória ou listagem do disco)"""
+        if self.segment_index_ready:
+            # mtime >= since: ignora entradas do diretório anterior que o índice ainda não removeu
+            files = self.segment_index.get(stream_key, {})
+            if files.get(output_path.name, (0, 0.0))[1] < since:
+                return False
+            return any(
+                name.endswith(SEGMENT_SUFFIXES) and mtime >= since
+                for name, (_, mtime) in files.items()
+            )
+        ts_files = [f for f in stream_dir.iterdir() if f.suffix in SEGMENT_SUFFIXES]
+        return len(ts_files) > 0 and output_path.exists()
+    
+    @staticmethod
+    async def _wait_dir_change(changed: asyncio.Event, process: asyncio.subprocess.Process, timeout: float):
+        """Espera arquivo novo no diretório, saída do processo ou timeout - o que vier primeiro"""
+        waiters = [asyncio.ensure_future(changed.wait()), asyncio.ensure_future(process.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+    
     async def _start_with_reencode(
         self,
         stream_key: str,
@@ -298,44 +735,138 @@ class StreamManager:
         """Inicia com re-encoding"""
         
         # Limpar diretório
-        if stream_dir.exists():
-            shutil.rmtree(stream_dir, ignore_errors=True)
+        await self.discard_stream_dir(stream_dir)
         stream_dir.mkdir(parents=True, exist_ok=True)
         
-        cmd = self._build_ffmpeg_command(source_url, output_path, stream_dir, use_copy=False)
-        print(f"🔄 Starting with re-encode...")
-        print(f"📝 CMD: {' '.join(cmd[:20])}...")
+        hw_encoder = await self._get_hw_encoder()
+        if time.time() - self._hw_failed_sources.get(source_url, 0) < HW_FALLBACK_TTL:
+            hw_encoder = None
         
-        try:
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
-                preexec_fn=os.setsid if os.name != 'nt' else None
+        while True:
+            cmd = self._build_ffmpeg_command(
+                source_url, output_path, stream_dir, use_copy=False,
+                latency_profile=self.streams[stream_key].latency_profile,
+                hw_encoder=hw_encoder
             )
+            logger.info("🔄 Starting with re-encode (%s)...", hw_encoder or 'libx264')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📝 CMD: %s", ' '.join(cmd))
             
-            self._register_process(stream_key, process, "reencode")
-            print(f"✅ Stream started: {stream_key} (PID: {process.pid})")
+            try:
+                process = await self._spawn_ffmpeg(cmd)
+            except Exception as e:
+                logger.error("❌ Error starting stream: %s", e)
+                entry = self.streams[stream_key]
+                entry.status = "error"
+                entry.error = str(e)
+                return
             
-        except Exception as e:
-            print(f"❌ Error starting stream: {e}")
-            self.streams[stream_key]["status"] = "error"
-            self.streams[stream_key]["error"] = str(e)
+            # _test_encode só valida o encoder: o decode na GPU (NVDEC sem o codec da câmera ->
+            # frames em memória de sistema que o scale_cuda recusa) só falha com a fonte real
+            exited = bool(hw_encoder) and await self._wait_exit(process, HW_STARTUP_GRACE)
+            
+            if stream_key not in self.streams:
+                # Parada durante a espera acima - processo ainda não registrado
+                self._kill_process(process)
+                return
+            
+            if exited:
+                stderr = (await self._stderr_tail(process))[-300:]
+                logger.warning("⚠️ %s re-encode exited at startup (exit: %s), falling back to libx264",
+                               hw_encoder, process.returncode)
+                if stderr:
+                    logger.warning("   Last error: %s", stderr)
+                self._hw_failed_sources[source_url] = time.time()
+                hw_encoder = None
+                await self.discard_stream_dir(stream_dir)
+                stream_dir.mkdir(parents=True, exist_ok=True)
+                continue
+            
+            self._register_process(stream_key, process, f"reencode-{hw_encoder}" if hw_encoder else "reencode")
+            logger.info("✅ Stream started: %s (PID: %s)", stream_key, process.pid)
+            return
+    
+    async def _spawn_ffmpeg(self, cmd: list) -> asyncio.subprocess.Process:
+        """Inicia FFmpeg num novo grupo de processos com o stderr drenado em background"""
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=os.name != 'nt',
+            # fds do Python já são O_CLOEXEC (PEP 446): pular a varredura de fds no spawn
+            close_fds=False,
+        )
+        # Pipe sempre consumido: FFmpeg nunca trava com o buffer de 64KB cheio
+        process.stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        process.stderr_reader = asyncio.create_task(
+            self._drain_stderr(process.stderr, process.stderr_tail)
+        )
+        return process
+    
+    @staticmethod
+    async def _drain_stderr(stream: asyncio.StreamReader, tail: deque):
+        """Consome o stderr até EOF guardando só as últimas linhas (bytes, decode só na falha)"""
+        # Leitura em blocos em vez de readline: uma linha enorme (ou só \r) não estoura o
+        # limite do StreamReader nem para o dreno - o que travaria o FFmpeg com o pipe cheio
+        pending = b""
+        try:
+            while True:
+                chunk = await stream.read(65536)
+                if not chunk:
+                    break
+                *lines, pending = (pending + chunk).split(b"\n")
+                for line in lines:
+                    tail.append(line[-STDERR_LINE_MAX:])
+                pending = pending[-STDERR_LINE_MAX:]
+        except Exception:
+            pass
+        if pending:
+            tail.append(pending)
+    
+    @staticmethod
+    async def _stderr_tail(process: asyncio.subprocess.Process) -> str:
+        """Últimas linhas do stderr (espera o leitor chegar ao EOF por até 1s)"""
+        try:
+            await asyncio.wait_for(asyncio.shield(process.stderr_reader), timeout=1)
+        except asyncio.TimeoutError:
+            pass
+        return b"\n".join(process.stderr_tail).decode(errors="replace")
+    
+    @staticmethod
+    async def _wait_exit(process: Optional[asyncio.subprocess.Process], timeout: float) -> bool:
+        """Dorme até `timeout` segundos, acordando na hora se o processo morrer"""
+        if process is None:
+            await asyncio.sleep(timeout)
+            return False
+        # Um único future de process.wait() por processo, reaproveitado a cada ciclo
+        # (asyncio.wait não cancela no timeout - dispensa o shield + task novos por tick)
+        waiter = getattr(process, "exit_waiter", None)
+        if waiter is None:
+            waiter = process.exit_waiter = asyncio.ensure_future(process.wait())
+        done, _ = await asyncio.wait((waiter,), timeout=timeout)
+        return bool(done)
+    
+    @staticmethod
+    def _until_next_tick(interval: float) -> float:
+        """Segundos até o próximo múltiplo de `interval` no relógio do loop"""
+        # Todos os watchdogs acordam no mesmo tick: N streams = 1 wakeup do loop por ciclo
+        return interval - (asyncio.get_running_loop().time() % interval)
     
-    def _register_process(self, stream_key: str, process: subprocess.Popen, mode: str):
+    def _register_process(self, stream_key: str, process: asyncio.subprocess.Process, mode: str):
         """Registra processo e inicia watchdog"""
         self.processes[stream_key] = process
-        self.streams[stream_key]["status"] = "running"
-        self.streams[stream_key]["pid"] = process.pid
-        self.streams[stream_key]["mode"] = mode
-        self.streams[stream_key]["last_segment_time"] = time.time()
+        entry = self.streams[stream_key]
+        entry.status = "running"
+        entry.pid = process.pid
+        entry.mode = mode
+        entry.last_segment_time = time.time()
         
         # Iniciar watchdog agressivo
         self.watchdog_tasks[stream_key] = asyncio.create_task(
             self._watchdog(stream_key)
         )
     
-    def _kill_process(self, process: subprocess.Popen):
+    def _kill_process(self, process: asyncio.subprocess.Process):
         """Mata processo de forma segura"""
         try:
             if os.name != 'nt':
@@ -352,7 +883,8 @@ class StreamManager:
         Streams RTMP push são gerenciados pelo nginx-rtmp e não precisam de restart.
         """
         
-        await asyncio.sleep(8)  # Aguardar inicialização (reduzido de 15s)
+        # Aguardar inicialização (reduzido de 15s) - morte do FFmpeg interrompe a espera
+        await self._wait_exit(self.processes.get(stream_key), 8)
         
         max_restarts = 15
         stall_threshold = 10  # Segundos sem novos segmentos (reduzido de 15s)
@@ -361,46 +893,51 @@ class StreamManager:
         consecutive_stalls = 0
         
         while stream_key in self.streams:
-            await asyncio.sleep(check_interval)
+            # Saída do processo é detectada via process.wait(), sem esperar o próximo ciclo.
+            # Processo já morto: dormir até o tick (wait retornaria na hora -> loop quente)
+            process = self.processes.get(stream_key)
+            if process is not None and process.returncode is None:
+                await self._wait_exit(process, self._until_next_tick(check_interval))
+            else:
+                await asyncio.sleep(self._until_next_tick(check_interval))
             
             # IMPORTANTE: Não reiniciar streams RTMP push - são gerenciados externamente
-            stream_info = self.streams.get(stream_key, {})
-            if stream_info.get("mode") == "rtmp-push":
+            stream_info = self.streams.get(stream_key)
+            if stream_info is None:
+                break
+            if stream_info.mode == "rtmp-push":
                 # Para RTMP push, apenas verificar se HLS está sendo gerado
-                stream_dir = Path(stream_info.get("dir", ""))
+                stream_dir = Path(stream_info.dir)
                 if stream_dir.exists():
                     newest = self._get_newest_segment_time(stream_dir)
                     if newest:
                         age = time.time() - newest
                         if age < 10:
                             # HLS sendo gerado normalmente
-                            if stream_info.get("status") != "running":
-                                self.streams[stream_key]["status"] = "running"
+                            if stream_info.status != "running":
+                                stream_info.status = "running"
                         elif age > 30:
                             # Sem segmentos por muito tempo - marcar como stopped
-                            if stream_info.get("status") == "running":
-                                print(f"⚠️ RTMP push stream {stream_key} stopped (no segments for {age:.0f}s)")
-                                self.streams[stream_key]["status"] = "stopped"
+                            if stream_info.status == "running":
+                                logger.warning("⚠️ RTMP push stream %s stopped (no segments for %.0fs)", stream_key, age)
+                                stream_info.status = "stopped"
                 continue
             
             if stream_key not in self.processes:
                 break
             
             process = self.processes[stream_key]
-            stream_dir = Path(self.streams[stream_key]["dir"])
+            stream_dir = Path(stream_info.dir)
             
             # Verificar se processo está rodando
-            if process.poll() is not None:
-                exit_code = process.poll()
-                stderr = ""
-                try:
-                    stderr = process.stderr.read().decode()[-300:] if process.stderr else ""
-                except:
-                    pass
-                print(f"⚠️ Stream {stream_key} process died (exit: {exit_code})")
+            if process.returncode is not None:
+                exit_code = process.returncode
+                stderr = (await self._stderr_tail(process))[-300:]
+                logger.warning("⚠️ Stream %s process died (exit: %s)", stream_key, exit_code)
                 if stderr:
-                    print(f"   Last error: {stderr}")
-                await self._handle_restart(stream_key)
+                    logger.warning("   Last error: %s", stderr)
+                if not await self._handle_restart(stream_key):
+                    break
                 consecutive_stalls = 0
                 continue
             
@@ -408,61 +945,81 @@ class StreamManager:
             newest_segment_time = self._get_newest_segment_time(stream_dir)
             
             if newest_segment_time:
-                self.streams[stream_key]["last_segment_time"] = newest_segment_time
+                stream_info.last_segment_time = newest_segment_time
                 age = time.time() - newest_segment_time
                 
                 if age > stall_threshold:
                     consecutive_stalls += 1
-                    print(f"⚠️ Stream {stream_key} stalled ({age:.1f}s, count={consecutive_stalls})")
+                    logger.warning("⚠️ Stream %s stalled (%.1fs, count=%s)", stream_key, age, consecutive_stalls)
                     
                     if consecutive_stalls >= 2:  # 2 checks seguidos = restart
-                        await self._handle_restart(stream_key)
+                        if not await self._handle_restart(stream_key):
+                            break
                         consecutive_stalls = 0
                 else:
                     consecutive_stalls = 0
             else:
                 # Sem segmentos ainda
-                stream_age = time.time() - self.streams[stream_key].get("start_time", time.time())
+                stream_age = time.time() - stream_info.start_time
                 if stream_age > 15:  # Se não gerou nenhum segmento em 15s
-                    print(f"⚠️ Stream {stream_key} never produced segments")
-                    await self._handle_restart(stream_key)
+                    logger.warning("⚠️ Stream %s never produced segments", stream_key)
+                    if not await self._handle_restart(stream_key):
+                        break
     
     def _get_newest_segment_time(self, stream_dir: Path) -> Optional[float]:
         """Retorna timestamp do segmento mais recente"""
-        if not stream_dir.exists():
-            return None
+        if self.segment_index_ready:
+            # mtimes já estão no índice inotify - checagem do watchdog sem nenhum syscall
+            files = self.segment_index.get(stream_dir.name)
+            if not files:
+                return None
+            return max(
+                (mtime for name, (_, mtime) in files.items() if name.endswith(SEGMENT_SUFFIXES)),
+                default=None,
+            )
         
+        # Sem índice: scandir (sem Path por arquivo) + endswith antes do stat
         newest_time = None
         try:
-            for f in stream_dir.iterdir():
-                if f.suffix == '.ts':
-                    mtime = f.stat().st_mtime
+            with os.scandir(stream_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(SEGMENT_SUFFIXES):
+                        continue
+                    try:
+                        mtime = entry.stat().st_mtime
+                    except FileNotFoundError:
+                        continue  # Apagado pelo FFmpeg (delete_segments) durante a varredura
                     if newest_time is None or mtime > newest_time:
                         newest_time = mtime
-        except:
-            pass
+        except OSError:
+            return None
         
         return newest_time
     
-    async def _handle_restart(self, stream_key: str):
-        """Reinicia stream com backoff"""
+    async def _handle_restart(self, stream_key: str) -> bool:
+        """Reinicia stream com backoff. False = não reinicia mais (watchdog deve parar)"""
         
         if stream_key not in self.streams:
-            return
+            return False
         
-        restart_count = self.streams[stream_key].get("restart_count", 0)
+        entry = self.streams[stream_key]
+        restart_count = entry.restart_count
         max_restarts = 15
         
         if restart_count >= max_restarts:
-            print(f"❌ Stream {stream_key} exceeded max restarts ({max_restarts})")
-            self.streams[stream_key]["status"] = "error"
-            self.streams[stream_key]["error"] = f"Exceeded {max_restarts} restarts"
-            return
+            logger.error("❌ Stream %s exceeded max restarts (%s)", stream_key, max_restarts)
+            entry.status = "error"
+            entry.error = f"Exceeded {max_restarts} restarts"
+            # Desistir de vez: sem processo registrado o watchdog não volta aqui a cada ciclo
+            process = self.processes.pop(stream_key, None)
+            if process is not None:
+                self._kill_process(process)
+            return False
         
         # Backoff exponencial: 1s, 2s, 4s, 8s... max 30s
-        backoff = min(30, 2 ** min(restart_count, 5))
+        backoff = min(30, 2 ** min(restart_count, 5)) + random.uniform(0, RESTART_JITTER)
         
-        print(f"🔄 Restarting stream {stream_key} (attempt {restart_count + 1}, backoff {backoff}s)")
+        logger.info("🔄 Restarting stream %s (attempt %s, backoff %.1fs)", stream_key, restart_count + 1, backoff)
         
         # Matar processo atual
         if stream_key in self.processes:
@@ -470,19 +1027,25 @@ class StreamManager:
             del self.processes[stream_key]
         
         # Incrementar contador
-        self.streams[stream_key]["restart_count"] = restart_count + 1
-        self.streams[stream_key]["status"] = "restarting"
+        entry.restart_count = restart_count + 1
+        entry.status = "restarting"
         
         await asyncio.sleep(backoff)
         
         # Reiniciar
-        source_url = self.streams[stream_key].get("source_url")
-        name = self.streams[stream_key].get("name")
+        source_url = entry.source_url
+        name = entry.name
+        latency_profile = entry.latency_profile
+        force_transcode = entry.force_transcode
         
         if source_url:
             # from_watchdog=True porque estamos sendo chamados de dentro do watchdog
             await self._cancel_watchdog(stream_key, from_watchdog=True)
-            await self._start_stream_internal(stream_key, source_url, name)
+            async with self._start_slots:
+                await self._start_stream_internal(
+                    stream_key, source_url, name, latency_profile, force_transcode
+                )
+        return True
     
     async def stop_stream(self, stream_key: str):
         """Para uma stream"""
@@ -501,53 +1064,97 @@ class StreamManager:
                     process.terminate()
                 
                 try:
-                    process.wait(timeout=3)
-                except subprocess.TimeoutExpired:
+                    await asyncio.wait_for(process.wait(), timeout=3)
+                except asyncio.TimeoutError:
                     self._kill_process(process)
                 
-                print(f"🛑 Stream stopped: {stream_key}")
+                logger.info("🛑 Stream stopped: %s", stream_key)
                 
             except Exception as e:
-                print(f"⚠️ Error stopping stream: {e}")
+                logger.warning("⚠️ Error stopping stream: %s", e)
             
             del self.processes[stream_key]
         
-        # Limpar diretório
-        if stream_key in self.streams:
-            stream_dir = Path(self.streams[stream_key].get("dir", ""))
-            if stream_dir.exists():
-                shutil.rmtree(stream_dir, ignore_errors=True)
-            del self.streams[stream_key]
+        # Remover do registro antes de limpar o diretório (a limpeza cede o event loop)
+        entry = self.streams.pop(stream_key, None)
+        self.playlist_cache.pop(stream_key, None)
+        if entry is not None:
+            await self.discard_stream_dir(Path(entry.dir))
+    
+    @staticmethod
+    def _remove_dir_sync(path: Path):
+        """Apaga um diretório de stream: unlink plano via scandir + rmdir (rmtree só se sobrar algo)"""
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            shutil.rmtree(entry.path, ignore_errors=True)
+                        else:
+                            os.unlink(entry.path)
+                    except FileNotFoundError:
+                        pass
+            os.rmdir(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # Arquivo novo criado durante a limpeza (FFmpeg/relay ainda escrevendo)
+            shutil.rmtree(path, ignore_errors=True)
+    
+    async def remove_stream_dir(self, path: Path):
+        """Remove o diretório numa thread - centenas de unlinks não travam o event loop"""
+        await asyncio.to_thread(self._remove_dir_sync, path)
+    
+    def _schedule_removal(self, path: Path):
+        """Apaga o diretório em background (referência guardada até a task terminar)"""
+        task = asyncio.create_task(self.remove_stream_dir(path))
+        self._cleanup_tasks.add(task)
+        task.add_done_callback(self._cleanup_tasks.discard)
+    
+    async def discard_stream_dir(self, path: Path):
+        """
+        Libera o caminho do diretório na hora: rename atômico para um nome oculto e
+        remoção em background. Start/stop não esperam pelos unlinks
+        """
+        discarded = path.with_name(f"{DISCARDED_DIR_PREFIX}{path.name}.old-{time.time_ns()}")
+        try:
+            os.rename(path, discarded)
+        except FileNotFoundError:
+            return
+        except OSError:
+            # Rename impossível (ex.: ponto de montagem) - apagar no lugar
+            await self.remove_stream_dir(path)
+            return
+        self._schedule_removal(discarded)
     
     async def stop_all(self):
-        """Para todas as streams"""
-        stream_keys = list(self.streams.keys())
-        for key in stream_keys:
-            await self.stop_stream(key)
+        """Para todas as streams em paralelo (períodos de graça do SIGTERM se sobrepõem)"""
+        stream_keys = list(self.streams.keys() | self.processes.keys())
+        await asyncio.gather(*(self.stop_stream(key) for key in stream_keys), return_exceptions=True)
     
     def get_stream_status(self, stream_key: str) -> Optional[dict]:
         """Retorna status de uma stream"""
         if stream_key not in self.streams:
             return None
         
-        info = self.streams[stream_key].copy()
+        info = asdict(self.streams[stream_key])
         
         # Adicionar info do processo
         if stream_key in self.processes:
             process = self.processes[stream_key]
-            info["process_running"] = process.poll() is None
+            info["process_running"] = process.returncode is None
         else:
             info["process_running"] = False
         
         # Adicionar idade do último segmento
-        stream_dir = Path(info.get("dir", ""))
+        stream_dir = Path(info["dir"])
         newest_time = self._get_newest_segment_time(stream_dir)
         if newest_time:
             info["last_segment_age"] = round(time.time() - newest_time, 1)
         
         # Contar segmentos
         try:
-            info["segment_count"] = len(list(Path(info.get("dir", "")).glob("*.ts")))
+            info["segment_count"] = sum(1 for f in stream_dir.iterdir() if f.suffix in SEGMENT_SUFFIXES)
         except:
             info["segment_count"] = 0
         
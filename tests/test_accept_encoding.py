@@ -0,0 +1,28 @@
+"""
+Negociação de gzip da playlist (Accept-Encoding)
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import _accepts_gzip  # noqa: E402
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", False),
+    ("gzip", True),
+    ("gzip, deflate, br", True),
+    ("br;q=1.0, gzip;q=0.8", True),
+    ("gzip;q=0", False),
+    ("gzip; q=0.0, deflate", False),
+    ("*", True),
+    ("*;q=0", False),
+    ("gzip;q=0, *", False),
+    ("x-gzip2, deflate", False),
+])
+def test_accepts_gzip(header, expected):
+    assert _accepts_gzip(header) is expected
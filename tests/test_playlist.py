@@ -0,0 +1,51 @@
+"""
+GET /hls/{stream_key}.m3u8 lendo do disco (sem índice inotify)
+"""
+
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from stream_manager import StreamEntry  # noqa: E402
+
+PLAYLIST = b"""#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-TARGETDURATION:1
+#EXT-X-MEDIA-SEQUENCE:1
+#EXTINF:1.000000,
+seg_1.ts
+"""
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    """Cliente sem lifespan: índice inotify inativo, playlist sempre localizada no disco"""
+    monkeypatch.setattr(main, "HLS_DIR", tmp_path)
+    monkeypatch.setattr(main.stream_manager, "hls_dir", tmp_path)
+    assert not main.stream_manager.segment_index_ready
+    yield TestClient(main.app)
+    main.stream_manager.streams.clear()
+    main.stream_manager.playlist_cache.clear()
+
+
+def test_playlist_with_custom_name_found_by_scandir(client, tmp_path):
+    stream_dir = tmp_path / "cam"
+    stream_dir.mkdir()
+    # Nome fora de index/{key}/playlist.m3u8: só o scandir encontra
+    (stream_dir / "live.m3u8").write_bytes(PLAYLIST)
+    (stream_dir / "seg_1.ts").write_bytes(b"\x47" * 188)
+    entry = StreamEntry(name=None, source_url="", status="running", dir=str(stream_dir))
+    main.stream_manager.streams["cam"] = entry
+
+    response = client.get("/hls/cam.m3u8")
+
+    assert response.status_code == 200, response.text
+    assert b"seg_1.ts" in response.content
+    # Nome lembrado: próximas requests vão direto no stat do arquivo certo
+    assert entry.playlist_name == "live.m3u8"
+    assert client.get("/hls/cam.m3u8").status_code == 200
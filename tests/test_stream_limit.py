@@ -0,0 +1,59 @@
+"""
+Limite de streams ativas (MAX_ACTIVE_STREAMS) no POST /streams
+"""
+
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from stream_manager import StreamEntry  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Cliente sem lifespan: sem workers, os starts ficam na fila (_starting)"""
+    monkeypatch.setattr(main, "MAX_ACTIVE_STREAMS", 3)
+    yield TestClient(main.app)
+    main.stream_manager.streams.clear()
+    main._starting.clear()
+    while not main._start_queue.empty():
+        main._start_queue.get_nowait()
+
+
+def _post(client, stream_key: str):
+    return client.post("/streams", json={"stream_key": stream_key, "source_url": "rtsp://cam/stream"})
+
+
+def _picked_by_worker(stream_key: str):
+    """Simula o _start_stream_internal: entra em streams como "starting" ainda em _starting"""
+    main.stream_manager.streams[stream_key] = StreamEntry(
+        name=None, source_url="rtsp://cam/stream", status="starting", dir=f"/tmp/hls/{stream_key}"
+    )
+
+
+def test_limit_reached_at_exactly_max_active_streams(client):
+    for i in range(3):
+        response = _post(client, f"cam{i}")
+        assert response.status_code == 200, response.text
+        _picked_by_worker(f"cam{i}")
+
+    assert main._starting == {"cam0", "cam1", "cam2"}
+
+    response = _post(client, "cam3")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    assert "cam3" not in main._starting
+
+
+def test_limit_allows_key_already_registered(client):
+    for i in range(3):
+        _post(client, f"cam{i}")
+        _picked_by_worker(f"cam{i}")
+
+    # Re-envio de uma key que já conta no limite não é recusado
+    assert _post(client, "cam1").status_code == 200
@@ -0,0 +1,46 @@
+"""
+Watchdog com o limite de restarts atingido
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stream_manager import StreamEntry, StreamManager  # noqa: E402
+
+
+def test_watchdog_stops_after_max_restarts(tmp_path):
+    async def scenario():
+        manager = StreamManager(hls_dir=tmp_path)
+        # Processo que já morreu
+        process = await manager._spawn_ffmpeg([sys.executable, "-c", "pass"])
+        await process.wait()
+
+        manager.processes["cam"] = process
+        manager.streams["cam"] = StreamEntry(
+            name=None, source_url="rtsp://cam/stream", status="running",
+            dir=str(tmp_path / "cam"), mode="copy", restart_count=15,
+        )
+
+        calls = 0
+        handle_restart = manager._handle_restart
+
+        async def counting_restart(stream_key):
+            nonlocal calls
+            calls += 1
+            return await handle_restart(stream_key)
+
+        manager._handle_restart = counting_restart
+
+        # Sem o fix o watchdog girava sem parar com o processo morto no registro
+        await asyncio.wait_for(manager._watchdog("cam"), timeout=5)
+        return manager, calls
+
+    manager, calls = asyncio.run(scenario())
+
+    assert calls == 1
+    assert "cam" not in manager.processes
+    assert manager.streams["cam"].status == "error"
+    assert manager.streams["cam"].error == "Exceeded 15 restarts"
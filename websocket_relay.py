@@ -13,12 +13,12 @@ Protocolo:
 """
 
 import asyncio
-import json
 import base64
 import time
 from typing import Dict, Set
 from dataclasses import dataclass, field
 from fastapi import WebSocket, WebSocketDisconnect
+import orjson
 
 
 @dataclass
@@ -167,7 +167,7 @@ async def handle_producer(websocket: WebSocket, stream_key: str):
             
             if "text" in message:
                 # Mensagem JSON
-                data = json.loads(message["text"])
+                data = orjson.loads(message["text"])
                 msg_type = data.get("type", "data")
                 
                 if msg_type == "ping":
@@ -208,7 +208,7 @@ async def handle_consumer(websocket: WebSocket, stream_key: str):
             message = await websocket.receive()
             
             if "text" in message:
-                data = json.loads(message["text"])
+                data = orjson.loads(message["text"])
                 if data.get("type") == "ping":
                     await websocket.send_text('{"type": "pong"}')
     